@@ -0,0 +1,119 @@
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import logging
+import random
+
+import socketio
+
+
+class AsyncTransport(object):
+
+    # reconnect with exponential backoff, delays are randomized by half of their length
+    reconnection_delay = 0.5
+    reconnection_delay_max = 60
+
+    def __init__(self, host='localhost', port=5000):
+        """
+        asyncio transport of one model client. Events are received on the event loop, the handlers of the
+        model (selection, training, evaluation) run in a single thread executor of this model, so they
+        never block the loop and run in order like with the blocking client. Many transports share one
+        event loop, see run. The server identifies a model by its connection, every model has its own.
+        Needs python-socketio with the asyncio client (pip install "python-socketio[asyncio_client]<5").
+        :param host: host url/ip
+        :param port: port of host
+        """
+        self.url = 'http://{}:{}'.format(host, port)
+        self.model = None
+        self.loop = None
+        self.client = None
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self._started = False
+        self._finished = None
+
+    def attach(self, model):
+        """
+        Called by BaseALModel instead of connecting.
+        :param model: BaseALModel
+        """
+        self.model = model
+
+    def send(self, event, message):
+        """
+        Emit to the server. Thread safe, called from the executor and the training and evaluation threads.
+        :param event: event name
+        :param message: message
+        """
+        asyncio.run_coroutine_threadsafe(self.client.emit(event, message, namespace='/model'), self.loop)
+
+    def finish(self, model):
+        """
+        The server finished the model, disconnect.
+        :param model: BaseALModel
+        """
+        self.loop.call_soon_threadsafe(self._finished.set)
+
+    def _call(self, handler, *args):
+        """
+        Run a handler of the model in its executor, without waiting for it.
+        """
+        future = self.loop.run_in_executor(self.executor, handler, *args)
+        future.add_done_callback(self._log_error)
+
+    def _log_error(self, future):
+        if future.exception() is not None:
+            logging.error('handler of model {} failed'.format(self.model.name), exc_info=future.exception())
+
+    def _on_registered(self, message):
+        self.model._on_registered(message)
+        if not self._started:
+            self._started = True
+            self.model._start()
+
+    async def run(self):
+        """
+        Connect, register and handle events until the server finishes the model.
+        """
+        self.loop = asyncio.get_event_loop()
+        self._finished = asyncio.Event()
+        self.client = socketio.AsyncClient(reconnection_delay=self.reconnection_delay,
+                                           reconnection_delay_max=self.reconnection_delay_max,
+                                           randomization_factor=0.5)
+        model = self.model
+
+        async def on_connect():
+            await self.client.emit('register', model._get_register_message(), namespace='/model')
+
+        def on_disconnect():
+            model.registered.clear()
+
+        self.client.on('connect', on_connect, namespace='/model')
+        self.client.on('disconnect', on_disconnect, namespace='/model')
+        self.client.on('registered', lambda message: self._call(self._on_registered, message), namespace='/model')
+        self.client.on('annotation', lambda message: self._call(model._on_annotation, message), namespace='/model')
+        self.client.on('next_utterance', lambda message: self._call(model._on_next_utterance, message),
+                       namespace='/model')
+        self.client.on('finished', lambda message: self._call(model._on_finished, message), namespace='/model')
+
+        # the client reconnects by itself after a connection was lost, but not for the first connection
+        delay = self.reconnection_delay
+        while True:
+            try:
+                await self.client.connect(self.url, namespaces=['/model'])
+                break
+            except socketio.exceptions.ConnectionError as e:
+                logging.warning('connection failed: {}'.format(e))
+            await asyncio.sleep(random.uniform(delay / 2, delay))
+            delay = min(delay * 2, self.reconnection_delay_max)
+        await self._finished.wait()
+        await self.client.disconnect()
+        self.executor.shutdown(wait=False)
+
+
+def run(transports):
+    """
+    Drive the models of all transports on one event loop until the server finished all of them.
+    Build the models with transport=AsyncTransport(...) first.
+    :param transports: list of AsyncTransport
+    """
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(asyncio.gather(*(transport.run() for transport in transports)))
@@ -1,30 +1,165 @@
 from socketIO_client import SocketIO, LoggingNamespace
+from socketIO_client import exceptions as sio_exceptions
 import time
 import logging
+import math
+import queue
+import random
 import threading
 logging.getLogger('socketIO-client').setLevel(logging.DEBUG)
 logging.basicConfig()
 
 
+class ModelHandle(object):
+
+    def __init__(self):
+        """
+        Thread safe reference to the most recently trained model. The training worker swaps in new
+        models, selection and scoring read the current one.
+        """
+        self._condition = threading.Condition()
+        self._model = None
+        self._count = -1
+        self._error = None
+
+    @property
+    def model(self):
+        return self._model
+
+    def get(self):
+        """
+        :return: current model and the number of annotated instances it was trained with
+        """
+        with self._condition:
+            return self._model, self._count
+
+    def swap(self, model, count):
+        """
+        Replace the current model and wake up everybody waiting for it.
+        :param model: trained model
+        :param count: number of annotated instances the model was trained with
+        """
+        with self._condition:
+            self._model = model
+            self._count = count
+            self._condition.notify_all()
+
+    def fail(self, error):
+        """
+        Training failed, wake up everybody waiting for a model.
+        :param error: exception raised by the training
+        """
+        with self._condition:
+            self._error = error
+            self._condition.notify_all()
+
+    def wait_for(self, count):
+        """
+        Block until a model trained with at least count annotated instances is available.
+        :param count: number of annotated instances
+        :return: model
+        """
+        with self._condition:
+            self._condition.wait_for(lambda: self._count >= count or self._error is not None)
+            if self._error is not None:
+                raise RuntimeError('training failed') from self._error
+            return self._model
+
+
+class EvaluationSchedule(object):
+
+    def __init__(self, every=1, growth=None):
+        """
+        Decides at which counts the model is evaluated on the test set. Either every n annotations or,
+        with growth, at log spaced counts: the next evaluation is due at count * growth.
+        Counts can grow by more than one per round, an evaluation is due once a count is reached or passed.
+        :param every: number of annotations between two evaluations
+        :param growth: factor between two evaluated counts, None to evaluate every n annotations
+        """
+        if every < 1:
+            raise ValueError('every must be at least 1')
+        if growth is not None and growth <= 1:
+            raise ValueError('growth must be greater than 1')
+        self.every = every
+        self.growth = growth
+        self._next = 0
+
+    def due(self, count):
+        """
+        Check if the model trained with count annotations must be evaluated and schedule the next evaluation.
+        :param count: number of annotated instances
+        :return: True if due
+        """
+        if count < self._next:
+            return False
+        if self.growth is None:
+            self._next = count + self.every
+        else:
+            self._next = max(count + self.every, int(math.ceil(count * self.growth)))
+        return True
+
+
 class BaseALModel(object):
 
-    def __init__(self, project_name, name, host='localhost', port=5000, simulation=False):
+    # seconds to wait for the 'registered' acknowledgement of the server
+    register_timeout = 30
+    # first and maximum delay in seconds between two connection attempts, doubled after every failed attempt
+    reconnect_delay = 0.5
+    max_reconnect_delay = 60
+
+    def __init__(self, project_name, name, host='localhost', port=5000, simulation=False, max_staleness=0,
+                 eval_every=1, eval_growth=None, transport=None):
         """
         Connect to the server and send initial scores. If simulation mode, start background thread
         to send annotated instances and scores to the server. Wait for any events from the server.
+        Models which implement training_snapshot and train are retrained in a background thread,
+        their scores are computed in another background thread.
         :param project_name: Name of the project
         :param name: name of this model/client
         :param host: host url/ip
         :param port: port of host
         :param simulation: simulation mode
+        :param max_staleness: number of annotations the model used for selection may lag behind
+        :param eval_every: number of annotations between two evaluations on the test set
+        :param eval_growth: evaluate at log spaced counts, factor between two evaluated counts
+        :param transport: transport which drives this model instead of the blocking socketIO client,
+        e.g. aio.AsyncTransport. The constructor returns without connecting, the transport calls
+        the event handlers and _start.
         """
         self.project_name = project_name
         self.name = name
         self.host = host
         self.port = port
         self.simulation = simulation
-
-        self.registered = False
+        self.max_staleness = max_staleness
+        self.eval_schedule = EvaluationSchedule(eval_every, eval_growth)
+        self.transport = transport
+
+        # set when the server acknowledged the registration of the current connection
+        self.registered = threading.Event()
+        self.finished = False
+        # messages emitted while not registered, sent after the next registration
+        self._emit_queue = list()
+        self._emit_lock = threading.Lock()
+
+        # batch mode: number of utterances proposed per round, set by the server
+        self.round_size = 1
+        # utterances of the current round which wait for a human annotation
+        self._outstanding = set()
+        self._round_utterances = list()
+        self._round_annotations = list()
+
+        # background training: annotations are added under data_lock, the worker takes a snapshot
+        # of the training data under the same lock and trains without holding it
+        self.model_handle = ModelHandle()
+        self.data_lock = threading.RLock()
+        self._train_requested = threading.Event()
+        self.pipelined = False
+        snapshot = self.training_snapshot()
+        if snapshot is not None:
+            self.pipelined = True
+            self.model_handle.swap(self.train(snapshot), self.get_count())
+            threading.Thread(target=self._run_training, daemon=True).start()
 
         if self.host == 'dummy':
             return
@@ -32,89 +167,293 @@ class BaseALModel(object):
         self.socketIO = None
         self.namespace = None
 
-        scores = self.get_scores()
-        count = self.get_count()
+        # models of the scheduled evaluations, scored in the order they were trained
+        self._eval_queue = queue.Queue()
+        if self.pipelined:
+            threading.Thread(target=self._run_evaluation, daemon=True).start()
+
+        if self.transport is not None:
+            self.transport.attach(self)
+            return
 
         self._connect()
-        self._on_events()
+        if self.finished:
+            return
+        self._start()
+        self._wait()
 
-        logging.info('start with scores: {} at count: {}'.format(scores, count))
-        self._emit_scores(scores, count)
+    def _start(self):
+        """
+        Called once after the first registration. Send the initial scores and start the simulation.
+        """
+        count = self.get_count()
+        logging.info('start at count: {}'.format(count))
+        self._evaluate(count, self.model_handle.model)
 
         if self.simulation:
             threading.Thread(target=self._run_simulation, daemon=True).start()
 
-        self.socketIO.wait()
-
     def _connect(self):
         """
-        Initiate namespace for socketIO and connect to server.
-        """
+        Connect to the server and wait until the registration is acknowledged. Failed attempts are
+        retried with exponential backoff and random jitter, so many clients do not reconnect at once.
+        Servers without acknowledgement are accepted after register_timeout.
+        """
+        delay = self.reconnect_delay
+        while not self.finished:
+            try:
+                self._open_connection()
+                if not self._wait_registered(self.register_timeout):
+                    logging.warning('no registration acknowledgement after {}s'.format(self.register_timeout))
+                    self._on_registered({})
+                return
+            except (sio_exceptions.ConnectionError, sio_exceptions.TimeoutError) as e:
+                logging.warning('connection failed: {}'.format(e))
+            self._close_connection()
+            sleep = random.uniform(delay / 2, delay)
+            logging.info('reconnect in {:.1f}s'.format(sleep))
+            time.sleep(sleep)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    def _open_connection(self):
+        """
+        Initiate namespace for socketIO and connect to server. The namespace sends the register message.
+        """
+        self.registered.clear()
         namespace_cls = self._get_namespace()
-        self.socketIO = SocketIO(self.host, self.port)
+        self.socketIO = SocketIO(self.host, self.port, wait_for_connection=False)
         self.namespace = self.socketIO.define(namespace_cls, '/model')
-        time.sleep(5)
+
+    def _close_connection(self):
+        """
+        Drop the current connection, if any.
+        """
+        if self.socketIO is not None:
+            try:
+                self.socketIO.disconnect()
+            except (sio_exceptions.ConnectionError, sio_exceptions.TimeoutError):
+                pass
+        self.socketIO = None
+        self.namespace = None
+
+    def _wait_registered(self, timeout):
+        """
+        Process events until the server acknowledged the registration.
+        :param timeout: seconds
+        :return: True if registered
+        """
+        deadline = time.time() + timeout
+        while not self.registered.is_set() and not self.finished and time.time() < deadline:
+            if not self.socketIO.connected:
+                raise sio_exceptions.ConnectionError('disconnected before the registration was acknowledged')
+            self.socketIO.wait(seconds=0.1)
+        return self.registered.is_set()
+
+    def _wait(self):
+        """
+        Process events until the server finishes the client. Reconnects if the connection is lost.
+        """
+        while not self.finished:
+            try:
+                self.socketIO.wait(seconds=1)
+                connected = self.socketIO.connected
+            except (sio_exceptions.ConnectionError, sio_exceptions.TimeoutError):
+                connected = False
+            if not self.finished and not connected:
+                logging.warning('connection lost')
+                self.registered.clear()
+                self._close_connection()
+                self._connect()
 
     def _get_namespace(self):
         """
         Add connect and reconnect listener to namespace to catch connect event and
-        send register message to server.
+        send register message to server. The event listeners are part of the namespace,
+        events arriving together with the connect event are not missed.
         :return:
         """
         outer = self
 
         class ALModelNamespace(LoggingNamespace):
             def on_connect(self):
-                message = outer._get_register_message()
-                self.emit('register', message)
+                self.emit('register', outer._get_register_message())
                 super(ALModelNamespace, self).on_connect()
 
             def on_reconnect(self):
-                message = outer._get_register_message()
-                self.emit('register', message)
+                self.emit('register', outer._get_register_message())
                 super(ALModelNamespace, self).on_reconnect()
 
+            def on_disconnect(self):
+                outer.registered.clear()
+                super(ALModelNamespace, self).on_disconnect()
+
+            def on_registered(self, message):
+                outer._on_registered(message)
+
+            def on_annotation(self, message):
+                outer._on_annotation(message)
+
+            def on_next_utterance(self, message):
+                outer._on_next_utterance(message)
+
+            def on_finished(self, message):
+                outer._on_finished(message)
+
         return ALModelNamespace
 
     def _get_register_message(self):
         """
         Compose register message for the server. Server checks if project
-        model combination if available and tags this client as online
+        model combination if available and tags this client as online. Includes the utterances which
+        wait for an annotation, the server sends annotations again which got lost while disconnected.
         :return: registration message
         """
         message = {'project_name': self.project_name,
                    'model_name': self.name,
-                   'count': self.get_count()}
+                   'count': self.get_count(),
+                   'pending': sorted(self._outstanding)}
         return message
 
-    def _on_events(self):
+    def _on_registered(self, message):
         """
-        Add event listeners to socketIO.
-        :return:
+        The server acknowledged the registration. Messages emitted while not registered are sent now.
+        :param message: count and batch_size known by the server
         """
-        self.namespace.on('annotation', self._on_annotation)
-        self.namespace.on('next_utterance', self._on_next_utterance)
-        self.namespace.on('finished', self._on_finished)
+        self.round_size = message.get('batch_size', self.round_size)
+        with self._emit_lock:
+            queued, self._emit_queue = self._emit_queue, list()
+            self.registered.set()
+        for event, message in queued:
+            self._emit(event, message)
+        logging.info('registered, sent {} queued messages'.format(len(queued)))
+
+    def _emit(self, event, message):
+        """
+        Emit to the server. Queued if the client is not registered, e.g. while reconnecting.
+        :param event: event name
+        :param message: message
+        """
+        if self.finished:
+            return
+        with self._emit_lock:
+            if not self.registered.is_set():
+                self._emit_queue.append((event, message))
+                return
+        try:
+            if self.transport is not None:
+                self.transport.send(event, message)
+            else:
+                self.namespace.emit(event, message)
+        except (sio_exceptions.ConnectionError, sio_exceptions.TimeoutError, AttributeError) as e:
+            logging.warning('emit {} failed, queued until reconnected: {}'.format(event, e))
+            with self._emit_lock:
+                self.registered.clear()
+                self._emit_queue.append((event, message))
 
     def _on_annotation(self, message):
         """
         Annotation event receives message from server containing utterance and human annotation.
-        Emits next selected utterance to server.
+        In batch mode annotations are collected until all utterances of the round are annotated.
+        Then all of them are added at once and the next round is emitted to the server.
         :param message: utterance and annotation from server
         """
         logging.info('received: {}'.format(message))
         io_time_start = message['io_time_start']
         client_time_start = time.time()
-        self.add_instance(utterance=message['utterance'],
-                          annotation=message['annotation'])
+        self.round_size = message.get('batch_size', self.round_size)
+
+        # utterances not proposed in this round (e.g. pending before a restart) are added right away
+        self._outstanding.discard(message['utterance'])
+        self._round_utterances.append(message['utterance'])
+        self._round_annotations.append(message['annotation'])
+        if self._outstanding:
+            return
 
-        scores = self.get_scores()
-        self._emit_scores(scores)
+        utterances, annotations = self._round_utterances, self._round_annotations
+        self._round_utterances, self._round_annotations = list(), list()
+        self._add_annotations(utterances, annotations)
 
         self._emit_next_utterance(client_time_start,
                                   io_time_start,
                                   prev_annotation=message['annotation'])
 
+    def _add_annotations(self, utterances, annotations):
+        """
+        Add annotated instances to the model. Without background training the model retrains in
+        add_instance and the scores are sent right away. Otherwise the training worker is triggered,
+        it sends the scores when the new model is ready. Blocks only if the model for the
+        next selection would be more than max_staleness annotations behind.
+        :param utterances: list of text
+        :param annotations: list of human labels
+        """
+        with self.data_lock:
+            if len(utterances) == 1:
+                self.add_instance(utterance=utterances[0],
+                                  annotation=annotations[0])
+            else:
+                self.add_instances(utterances, annotations)
+            count = self.get_count()
+
+        if not self.pipelined:
+            if self.host != 'dummy':
+                self._evaluate(count)
+            return
+
+        self._train_requested.set()
+        self.model_handle.wait_for(count - self.max_staleness)
+
+    def _run_training(self):
+        """
+        Training worker. Started in a separate thread. Trains a new model whenever annotations were added
+        and swaps it in. Annotations added while training are picked up by the next iteration together.
+        """
+        while True:
+            self._train_requested.wait()
+            self._train_requested.clear()
+            with self.data_lock:
+                snapshot = self.training_snapshot()
+                count = self.get_count()
+            try:
+                model = self.train(snapshot)
+            except Exception as e:
+                logging.exception('training failed at count {}'.format(count))
+                self.model_handle.fail(e)
+                return
+            self.model_handle.swap(model, count)
+            logging.info('trained model at count {}'.format(count))
+
+            if self.host != 'dummy':
+                self._evaluate(count, model)
+
+    def _evaluate(self, count, model=None):
+        """
+        Evaluate the model on the test set if the schedule says so. Models trained in the background
+        are handed to the evaluation worker, otherwise the scores are computed right away.
+        :param count: number of annotated instances the model was trained with
+        :param model: trained model, None for models which train in add_instance
+        """
+        if not self.eval_schedule.due(count):
+            return
+        if self.pipelined:
+            self._eval_queue.put((model, count))
+        else:
+            self._emit_scores(self.get_scores(), count)
+
+    def _run_evaluation(self):
+        """
+        Evaluation worker. Started in a separate thread. Scores the models handed over by _evaluate
+        and sends the scores with the count the model was trained with. Models are not modified after
+        training, so the worker does not hold any lock.
+        """
+        while True:
+            model, count = self._eval_queue.get()
+            try:
+                self._emit_scores(self.get_scores(model), count)
+            except Exception:
+                logging.exception('evaluation failed at count {}'.format(count))
+            finally:
+                self._eval_queue.task_done()
+
     def _on_finished(self, message):
         """
         Client gets disconnected on 'finished' message from server. Includes the cause to shut client down.
@@ -122,13 +461,18 @@ class BaseALModel(object):
         """
         cause = message['cause']
         logging.info('Server is finished with client: {}'.format(cause))
-        self.socketIO.disconnect()
+        self.finished = True
+        if self.transport is not None:
+            self.transport.finish(self)
+        else:
+            self.socketIO.disconnect()
 
     def _on_next_utterance(self, message):
         """
         Select and emit the next utterance to the server.
-        :param message: io_time_start: timestamp of serverside transmission start
+        :param message: io_time_start: timestamp of serverside transmission start, batch_size: utterances per round
         """
+        self.round_size = message.get('batch_size', self.round_size)
         if self.simulation:
             return
         io_time_start = message['io_time_start']
@@ -159,16 +503,36 @@ class BaseALModel(object):
                    'client_time': client_time,
                    'al_time': al_time,
                    'io_time_start': io_time_start}
-        self.namespace.emit('utterance', message)
+        self._emit('utterance', message)
         logging.info("Sent utterance '{}' at count {}".format(utterance, count))
 
+    def _emit_utterances(self, utterances, labels, client_time, al_time, io_time_start):
+        """
+        Batch mode. Compose the message with all utterances of one round for the server.
+        :param utterances: list of text
+        :param labels: list of labels, attached in simulation mode
+        :param client_time: total time spent on the client for the round
+        :param al_time: time spent for the al algorithm for the round
+        :param io_time_start: timestamp of serverside transmission start
+        """
+        count = self.get_count()
+        message = {'utterances': [{'utterance': utterance, 'label': label if self.simulation else None}
+                                  for utterance, label in zip(utterances, labels)],
+                   'count': count,
+                   'client_time': client_time,
+                   'al_time': al_time,
+                   'io_time_start': io_time_start}
+        self._emit('utterances', message)
+        logging.info("Sent {} utterances at count {}".format(len(utterances), count))
+
     def _emit_next_utterance(self, client_time_start=None, io_time_start=None, prev_annotation=None):
         """
-        Query the AL algorithm to get next utterance and send it to the server.
+        Query the AL algorithm to get next utterance and send it to the server. In batch mode
+        round_size utterances are selected and sent together.
         Keeps track of different times during computations.
         :param client_time_start: timestamp when client receives instance
         :param io_time_start: timestamp of serverside transmission start
-        :return:
+        :return: list of utterance, label
         """
         if client_time_start is None:
             client_time_start = time.time()
@@ -176,18 +540,33 @@ class BaseALModel(object):
             io_time_start = time.time()
 
         al_time_start = time.time()
-        utterance, label = self.get_next_utterance(prev_annotation)
+        if self.round_size > 1:
+            selected = self.get_next_utterances(self.round_size, prev_annotation)
+        else:
+            selected = [self.get_next_utterance(prev_annotation)]
 
         time_end = time.time()
         client_time = time_end - client_time_start
         al_time = time_end - al_time_start
 
-        self._emit_utterance(utterance,
-                             client_time,
-                             al_time,
-                             io_time_start,
-                             label=label)
-        return utterance, label
+        if not self.simulation:
+            self._outstanding.update(utterance for utterance, _ in selected)
+
+        if len(selected) == 1:
+            utterance, label = selected[0]
+            self._emit_utterance(utterance,
+                                 client_time,
+                                 al_time,
+                                 io_time_start,
+                                 label=label)
+        else:
+            utterances, labels = zip(*selected)
+            self._emit_utterances(utterances,
+                                  labels,
+                                  client_time,
+                                  al_time,
+                                  io_time_start)
+        return selected
 
     def _emit_scores(self, scores, count=None):
         """
@@ -200,7 +579,7 @@ class BaseALModel(object):
             count = self.get_count()
         precision, recall, f1 = scores
         message = {'precision': precision, 'recall': recall, 'f1': f1, 'count': count}
-        self.namespace.emit('scores', message)
+        self._emit('scores', message)
         logging.info("Sent scores {} at count {}".format(scores, count))
 
     def get_next_utterance(self, prev_annotation=None):
@@ -210,6 +589,16 @@ class BaseALModel(object):
         """
         raise NotImplementedError
 
+    def get_next_utterances(self, k, prev_annotation=None):
+        """
+        Override this in a custom model to support batch mode. Select k distinct utterances at once.
+        :param k: number of utterances
+        :return: list of utterance, label/None
+        """
+        if k == 1:
+            return [self.get_next_utterance(prev_annotation)]
+        raise NotImplementedError('batch mode is not supported by this model')
+
     def get_count(self):
         """
         Override this in a custom model.
@@ -217,9 +606,11 @@ class BaseALModel(object):
         """
         raise NotImplementedError
 
-    def get_scores(self):
+    def get_scores(self, model=None):
         """
-        Override this in a custom model.
+        Override this in a custom model. Models which train in the background are evaluated in the
+        evaluation worker with the model to score.
+        :param model: trained model from model_handle, None for the current model
         :return: precision, recall and f1 score
         """
         raise NotImplementedError
@@ -232,6 +623,32 @@ class BaseALModel(object):
         """
         raise NotImplementedError
 
+    def training_snapshot(self):
+        """
+        Override this together with train to retrain in a background thread. Called with data_lock held.
+        Return everything train needs, it must not change when further instances are added.
+        :return: snapshot of the training data or None to train in add_instance
+        """
+        return None
+
+    def train(self, snapshot):
+        """
+        Override this together with training_snapshot. Called in the training worker without data_lock.
+        Must not modify the current model (model_handle.model), selection may still use it.
+        :param snapshot: return value of training_snapshot
+        :return: trained model
+        """
+        raise NotImplementedError
+
+    def add_instances(self, utterances, annotations):
+        """
+        Override this in a custom model to add all annotations of a round at once, e.g. to train only once.
+        :param utterances: list of text
+        :param annotations: list of human labels
+        """
+        for utterance, annotation in zip(utterances, annotations):
+            self.add_instance(utterance, annotation)
+
     def _run_simulation(self):
         """
         Simulation mode.
@@ -239,9 +656,9 @@ class BaseALModel(object):
         read it from a provided label file and send results to the server.
         """
         label = None
-        while True:
-            utterance, label = self._emit_next_utterance(label)
-            self.add_instance(utterance, label)
-
-            scores = self.get_scores()
-            self._emit_scores(scores)
+        # with the asyncio transport other models keep the process running after the server finished this one
+        while not self.finished:
+            selected = self._emit_next_utterance(prev_annotation=label)
+            utterances, labels = zip(*selected)
+            label = labels[-1]
+            self._add_annotations(list(utterances), list(labels))
@@ -0,0 +1,141 @@
+import logging
+import threading
+import time
+
+import numpy as np
+
+
+class LocalTransport(object):
+
+    def __init__(self, max_count, batch_size=1):
+        """
+        In-process stand-in for the server of a simulation run. Takes the utterances and scores a model
+        emits like the server does, but keeps them in columns in memory instead of a database. Finishes
+        the model when max_count is reached, like the server. Used by run, needs a model in simulation mode.
+        :param max_count: number of annotated instances after which the model is finished
+        :param batch_size: utterances per round
+        """
+        self.max_count = max_count
+        self.batch_size = batch_size
+        self.model = None
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+        self.utterances = list()
+        self.labels = list()
+        self.counts = list()
+        self.client_times = list()
+        self.al_times = list()
+        self.score_counts = list()
+        self.precisions = list()
+        self.recalls = list()
+        self.f1s = list()
+
+    def attach(self, model):
+        """
+        Called by BaseALModel instead of connecting.
+        :param model: BaseALModel
+        """
+        self.model = model
+
+    def send(self, event, message):
+        """
+        Handle a message of the model, called from the simulation and the evaluation thread.
+        :param event: event name
+        :param message: message
+        """
+        if event in ('utterance', 'utterances') and message['count'] >= self.max_count:
+            # unlike the server, keep the scores of the models which are still evaluated
+            if self.model.pipelined:
+                self.model._eval_queue.join()
+            self.model._on_finished({'cause': 'max count: {} reached'.format(self.max_count)})
+            return
+        with self.lock:
+            if event == 'utterance':
+                self._store([message], message)
+            elif event == 'utterances':
+                self._store(message['utterances'], message)
+            elif event == 'scores':
+                self.score_counts.append(message['count'])
+                self.precisions.append(message['precision'])
+                self.recalls.append(message['recall'])
+                self.f1s.append(message['f1'])
+
+    def _store(self, utterances, message):
+        """
+        Store the utterances of one round, times of the round are split evenly like on the server.
+        :param utterances: list of dicts with utterance and label
+        :param message: times and count of the round
+        """
+        count = message['count']
+        for item in utterances:
+            self.utterances.append(item['utterance'])
+            self.labels.append(item['label'])
+            self.counts.append(count)
+            self.client_times.append(message['client_time'] / len(utterances))
+            self.al_times.append(message['al_time'] / len(utterances))
+
+    def finish(self, model):
+        """
+        The model was finished.
+        :param model: BaseALModel
+        """
+        self.finished.set()
+
+    def run(self):
+        """
+        Register the model, send the initial scores and run the simulation in this thread
+        until max_count is reached.
+        """
+        model = self.model
+        model._on_registered({'count': model.get_count(), 'batch_size': self.batch_size})
+        model._evaluate(model.get_count(), model.model_handle.model)
+        model._run_simulation()
+
+    def save(self, path, project_name, model_name, wall_time):
+        """
+        Write the results as compressed numpy columns (.npz). Instance columns: utterance, label, count,
+        client_time, al_time. Score columns: score_count, precision, recall, f1.
+        :param path: results file
+        :param project_name: name of the project of the model
+        :param model_name: name of the model
+        :param wall_time: seconds the simulation took
+        """
+        with self.lock:
+            np.savez_compressed(path,
+                                project_name=np.array(project_name),
+                                model_name=np.array(model_name),
+                                final_count=np.array(self.model.get_count(), dtype=np.int64),
+                                wall_time=np.array(wall_time),
+                                utterance=np.array(self.utterances, dtype=str),
+                                label=np.array(self.labels, dtype=np.int8),
+                                count=np.array(self.counts, dtype=np.int64),
+                                client_time=np.array(self.client_times, dtype=np.float64),
+                                al_time=np.array(self.al_times, dtype=np.float64),
+                                score_count=np.array(self.score_counts, dtype=np.int64),
+                                precision=np.array(self.precisions, dtype=np.float64),
+                                recall=np.array(self.recalls, dtype=np.float64),
+                                f1=np.array(self.f1s, dtype=np.float64))
+
+
+def run(model_cls, results_file, max_count, batch_size=1, **kwargs):
+    """
+    Headless simulation: drive a model in this process without server and database, the labels
+    come from the model like in simulation mode. Times and scores are written to results_file,
+    which can be imported into a project with the /project/<project_id>/import endpoint of the server.
+    :param model_cls: subclass of BaseALModel which supports simulation mode, or a function which builds one
+    :param results_file: path of the .npz results file
+    :param max_count: number of annotated instances to simulate
+    :param batch_size: utterances per round
+    :param kwargs: arguments of model_cls, project_name and name are stored in the results file
+    :return: LocalTransport with the results
+    """
+    transport = LocalTransport(max_count, batch_size)
+    start = time.time()
+    model_cls(simulation=True, transport=transport, **kwargs)
+    transport.run()
+    wall_time = time.time() - start
+    transport.save(results_file, kwargs['project_name'], kwargs['name'], wall_time)
+    logging.info('simulated {} instances in {:.1f}s, results in {}'.format(len(transport.utterances),
+                                                                           wall_time, results_file))
+    return transport
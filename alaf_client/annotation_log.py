@@ -0,0 +1,159 @@
+from collections import namedtuple
+import os
+import struct
+import time
+import zlib
+
+magic = b'ALAFLOG1'
+# pool row, label, count after the record, timestamp, length of the text
+header = struct.Struct('<qiqdI')
+checksum = struct.Struct('<I')
+
+Annotation = namedtuple('Annotation', ['row', 'label', 'count', 'timestamp', 'text'])
+
+
+def encode(row, label, count, timestamp, text=None):
+    """
+    One record of the log: fixed size header, utf-8 text (only for utterances which are not in
+    the pool, row -1) and crc32 of both.
+    :return: bytes
+    """
+    text = text.encode('utf-8') if text is not None else b''
+    record = header.pack(row, label, count, timestamp, len(text)) + text
+    return record + checksum.pack(zlib.crc32(record))
+
+
+def decode(buffer, offset):
+    """
+    Decode the record at offset.
+    :param buffer: bytes of the log
+    :param offset: start of the record
+    :return: Annotation and offset of the next record, None if the record is incomplete or corrupt
+    """
+    end = offset + header.size
+    if end > len(buffer):
+        return None
+    row, label, count, timestamp, text_length = header.unpack_from(buffer, offset)
+    if end + text_length + checksum.size > len(buffer):
+        return None
+    crc, = checksum.unpack_from(buffer, end + text_length)
+    if crc != zlib.crc32(buffer[offset:end + text_length]):
+        return None
+    text = buffer[end:end + text_length].decode('utf-8') if text_length else None
+    return Annotation(row, label, count, timestamp, text), end + text_length + checksum.size
+
+
+class AnnotationLog(object):
+
+    def __init__(self, path, flush_every=1, fsync=False):
+        """
+        Append-only binary log of the annotated instances. Records are checksummed, a record which was
+        only partly written when the client crashed is cut off when the log is opened again.
+        Records are flushed in groups of flush_every, records which were not flushed yet are lost on a crash.
+        :param path: log file
+        :param flush_every: number of records written before the log is flushed to the OS
+        :param fsync: also force flushed records to disk, survives a crash of the machine
+        """
+        self.path = path
+        self.flush_every = max(flush_every, 1)
+        self.fsync = fsync
+        self.records = list()
+        self._pending = 0
+
+        if not os.path.exists(path):
+            self._create(path, [])
+        with open(path, 'rb') as f:
+            buffer = f.read()
+        if buffer[:len(magic)] != magic:
+            raise ValueError('not an annotation log: {}'.format(path))
+
+        offset = len(magic)
+        while offset < len(buffer):
+            decoded = decode(buffer, offset)
+            if decoded is None:
+                break
+            record, offset = decoded
+            self.records.append(record)
+
+        self._file = open(path, 'r+b')
+        if offset < len(buffer):
+            print('annotation log {}: drop {} bytes of an incomplete record'.format(path, len(buffer) - offset))
+            self._file.truncate(offset)
+        self._file.seek(offset)
+
+    @staticmethod
+    def _create(path, records):
+        """
+        Write a new log with the given records. Written under a temporary name and moved in place.
+        :param path: log file
+        :param records: list of Annotation
+        """
+        with open(path + '.tmp', 'wb') as f:
+            f.write(magic)
+            for record in records:
+                f.write(encode(*record))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def migrate(cls, path, utterance_file, annotation_file, rows_of, **kwargs):
+        """
+        Create the log from the text files of older versions, one utterance per line in utterance_file
+        and one label per line in annotation_file. Lines without a partner in the other file are dropped.
+        :param path: log file
+        :param utterance_file: alaf.txt
+        :param annotation_file: alaf_annotation.txt
+        :param rows_of: function utterance -> pool rows
+        :param kwargs: see __init__
+        :return: AnnotationLog
+        """
+        with open(utterance_file) as f:
+            utterances = [l.rstrip() for l in f]
+        with open(annotation_file) as f:
+            labels = [int(l) for l in f if l.strip()]
+        timestamp = os.path.getmtime(annotation_file)
+
+        records = list()
+        for count, (utterance, label) in enumerate(zip(utterances, labels), 1):
+            rows = rows_of(utterance)
+            if len(rows):
+                records.append(Annotation(int(rows[0]), label, count, timestamp, None))
+            else:
+                records.append(Annotation(-1, label, count, timestamp, utterance))
+        print('migrate {} annotations from {} into {}'.format(len(records), utterance_file, path))
+        cls._create(path, records)
+        return cls(path, **kwargs)
+
+    def __len__(self):
+        return len(self.records)
+
+    def append(self, annotations):
+        """
+        Append annotated instances, flushed when flush_every records are pending.
+        :param annotations: list of pool row, label, text; text only for utterances which are not in
+        the pool (row -1), otherwise None
+        """
+        timestamp = time.time()
+        chunk = list()
+        for row, label, text in annotations:
+            record = Annotation(row, label, len(self.records) + 1, timestamp, text)
+            self.records.append(record)
+            chunk.append(encode(*record))
+        self._file.write(b''.join(chunk))
+        self._pending += len(chunk)
+        if self._pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        """
+        Flush pending records, to disk if fsync.
+        """
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+        self._pending = 0
+
+    def close(self):
+        self.flush()
+        self._file.close()
@@ -0,0 +1,99 @@
+import argparse
+import time
+from random import Random
+
+from sklearn.metrics import f1_score
+
+from buffers import SparseRowBuffer
+from example import get_dataset
+from learners import get_learner, learners
+from selection import least_confident
+import numpy as np
+
+
+# python benchmark_learners.py -data_dir ./data/example/ -n 200
+
+
+def run(name, dataset, x_pool, y_pool, order):
+    """
+    Simulate an annotation session with one learner backend. Adds the pool instances in the given order
+    one by one, like SvmALModel.add_instance, and measures the time to update the learner and to select
+    the least confident unselected pool instance with its weights like the selection workers (al_time).
+    :return: list of train times, list of selection times, f1 on test set after the last instance
+    """
+    training_data = SparseRowBuffer(dataset['x_train'].shape[1], label_dtype=dataset['y_train'].dtype)
+    training_data.append(dataset['x_train'], dataset['y_train'])
+    learner = get_learner(name).fit(training_data.rows(), training_data.labels())
+    pool = SparseRowBuffer(x_pool.shape[1])
+    pool.append(x_pool, np.zeros(x_pool.shape[0]))
+    selected = np.zeros(x_pool.shape[0], dtype=np.uint8)
+
+    train_times = list()
+    al_times = list()
+    for idx in order:
+        x_new, y_new = x_pool[idx], [y_pool[idx]]
+        start = time.time()
+        if learner.incremental:
+            learner.update(None, None, x_new, y_new)
+        else:
+            training_data.append(x_new, y_new)
+            learner.update(training_data.rows(), training_data.labels(), x_new, y_new)
+        train_times.append(time.time() - start)
+
+        selected[idx] = 1
+        start = time.time()
+        coef, intercept = learner.weights()
+        least_confident(pool, coef, intercept, 0, len(pool), selected, 1)
+        al_times.append(time.time() - start)
+
+    f1 = f1_score(dataset['y_test'], learner.predict(dataset['x_test']))
+    return train_times, al_times, f1
+
+
+def mean(values):
+    return sum(values) / max(len(values), 1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare train and al_time of the learner backends')
+
+    parser.add_argument('-data_dir', type=str,
+                        help='Path to data directory, needs pool_label.txt')
+
+    parser.add_argument('-learners', type=str, nargs='+', default=sorted(set(learners) - {'svc_margin'}),
+                        help='learner backends to compare, svc is the baseline')
+
+    parser.add_argument('-n', type=int, default=200,
+                        help='Number of simulated annotations')
+
+    parser.add_argument('-seed', type=int, default=0,
+                        help='Seed for the order of the pool instances')
+
+    args = parser.parse_args()
+    dataset = get_dataset(args.data_dir)
+    x_pool = dataset['vectorizer'].transform(open(dataset['pool_file']))
+    y_pool = dataset['pool_labels']
+    order = list(range(len(y_pool)))
+    Random(args.seed).shuffle(order)
+    order = order[:args.n]
+
+    # al_time curve in quarters of the session, relative to svc if it is part of the comparison
+    quarters = [order[i * len(order) // 4:(i + 1) * len(order) // 4] for i in range(4)]
+    results = {name: run(name, dataset, x_pool, y_pool, order) for name in args.learners}
+    baseline = results.get('svc')
+
+    print('{:<12}{:>10}{:>10}{}{:>8}'.format('learner', 'train', 'al_time',
+                                             ''.join('{:>14}'.format('al_time q{}'.format(q + 1)) for q in range(4)),
+                                             'f1'))
+    for name, (train_times, al_times, f1) in results.items():
+        curve = list()
+        start = 0
+        for quarter in quarters:
+            end = start + len(quarter)
+            value = mean(al_times[start:end])
+            if baseline is not None:
+                curve.append('{:>9.4f}s {:>4.0%}'.format(value, value / max(mean(baseline[1][start:end]), 1e-9)))
+            else:
+                curve.append('{:>14.4f}'.format(value))
+            start = end
+        print('{:<12}{:>9.4f}s{:>9.4f}s{}{:>8.3f}'.format(name, mean(train_times), mean(al_times), ''.join(curve), f1))
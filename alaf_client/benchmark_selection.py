@@ -0,0 +1,117 @@
+import argparse
+import tempfile
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from learners import SvcLearner
+from pool import PoolMatrix, write_pool_matrix
+from selection import least_confident
+
+
+# python benchmark_selection.py -sizes 100000 1000000 10000000 -legacy_max 1000000
+
+
+def random_rows(n_rows, n_features, nnz, random):
+    """
+    Sparse count vectors with nnz random features per row, like a vectorized pool.
+    :return: csr_matrix
+    """
+    indices = random.randint(0, n_features, size=n_rows * nnz)
+    indptr = np.arange(0, n_rows * nnz + 1, nnz)
+    return csr_matrix((np.ones(n_rows * nnz), indices, indptr), shape=(n_rows, n_features))
+
+
+def legacy_selection(x, ml_model, lines, alaf_lines):
+    """
+    Previous selection: probabilities per row in a list comprehension, minimum in a python loop
+    with a string set lookup per row.
+    :return: row index
+    """
+    confs = [max(v) for v in ml_model.predict_proba(x)]
+    confidence = None
+    idx = None
+    for i, c in enumerate(confs):
+        if (idx is None or c < confidence) and lines[i] not in alaf_lines:
+            confidence = c
+            idx = i
+    return idx
+
+
+def timed(func, repeat):
+    """
+    :return: best time of repeat calls
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.time()
+        func()
+        duration = time.time() - start
+        best = duration if best is None else min(best, duration)
+    return best
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compare vectorized least confidence selection with the previous path')
+
+    parser.add_argument('-sizes', type=int, nargs='+', default=[100000, 1000000, 10000000],
+                        help='Number of pool rows')
+
+    parser.add_argument('-features', type=int, default=50000,
+                        help='Vocabulary size')
+
+    parser.add_argument('-nnz', type=int, default=10,
+                        help='Non zero features per row')
+
+    parser.add_argument('-k', type=int, default=10,
+                        help='Utterances per round for the top-k selection')
+
+    parser.add_argument('-selected', type=float, default=0.01,
+                        help='Fraction of already selected rows')
+
+    parser.add_argument('-legacy_max', type=int, default=1000000,
+                        help='Largest pool for the previous path, it needs the pool in memory')
+
+    parser.add_argument('-block_size', type=int, default=100000,
+                        help='Rows scored at once')
+
+    parser.add_argument('-repeat', type=int, default=3,
+                        help='Runs per measurement, the best is reported')
+
+    args = parser.parse_args()
+    random = np.random.RandomState(0)
+
+    x_train = random_rows(500, args.features, args.nnz, random)
+    y_train = (np.asarray(x_train[:, :args.features // 2].sum(axis=1)).ravel() > args.nnz / 2).astype(int)
+    learner = SvcLearner().fit(x_train, y_train)
+    coef, intercept = learner.weights()
+
+    print('{:>10}{:>12}{:>12}{:>12}{:>10}'.format('rows', 'previous', 'top-1', 'top-{}'.format(args.k), 'speedup'))
+    for n_rows in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            chunks = (random_rows(min(args.block_size, n_rows - start), args.features, args.nnz, random)
+                      for start in range(0, n_rows, args.block_size))
+            write_pool_matrix(chunks, args.features, tmp_dir)
+            matrix = PoolMatrix(tmp_dir)
+
+            mask = (random.random_sample(n_rows) < args.selected).astype(np.int8)
+            top_1 = timed(lambda: least_confident(matrix, coef, intercept, 0, n_rows, mask, 1, args.block_size),
+                          args.repeat)
+            top_k = timed(lambda: least_confident(matrix, coef, intercept, 0, n_rows, mask, args.k, args.block_size),
+                          args.repeat)
+
+            legacy = None
+            if n_rows <= args.legacy_max:
+                x = matrix.rows(0, n_rows)
+                lines = ['utterance {}'.format(i) for i in range(n_rows)]
+                alaf_lines = set(lines[i] for i in np.flatnonzero(mask))
+                legacy = timed(lambda: legacy_selection(x, learner.ml_model, lines, alaf_lines), 1)
+                del x, lines, alaf_lines
+            del matrix
+
+        print('{:>10}{:>12}{:>11.3f}s{:>11.3f}s{:>10}'.format(
+            n_rows,
+            '{:.3f}s'.format(legacy) if legacy is not None else '-',
+            top_1, top_k,
+            '{:.0f}x'.format(legacy / top_1) if legacy is not None else '-'))
@@ -0,0 +1,94 @@
+from scipy.sparse import csr_matrix
+import numpy as np
+
+
+class SparseRowBuffer(object):
+
+    def __init__(self, n_features, dtype=np.float64, label_dtype=np.int64, capacity=1024, nnz_capacity=None):
+        """
+        Growable CSR matrix with one label per row. data, indices, indptr and labels are preallocated and
+        doubled when full, so appending n rows one by one copies O(n) instead of O(n^2) like vstack.
+        rows and labels return views, appending does not change views taken before.
+        :param n_features: number of columns
+        :param dtype: dtype of the values, float64 is what the sklearn learners use internally
+        :param label_dtype: dtype of the labels
+        :param capacity: initial number of rows
+        :param nnz_capacity: initial number of non zero values, default 16 per row
+        """
+        self.n_features = n_features
+        self.n_rows = 0
+        self.nnz = 0
+        capacity = max(capacity, 1)
+        self.data = np.empty(nnz_capacity or capacity * 16, dtype=dtype)
+        self.indices = np.empty(len(self.data), dtype=np.int32)
+        self.indptr = np.zeros(capacity + 1, dtype=np.int32)
+        self.y = np.empty(capacity, dtype=label_dtype)
+
+    def __len__(self):
+        return self.n_rows
+
+    @staticmethod
+    def _grow(array, size):
+        """
+        Copy array into a new array with at least size entries, at least twice as large.
+        """
+        grown = np.empty(max(size, 2 * len(array)), dtype=array.dtype)
+        grown[:len(array)] = array
+        return grown
+
+    def append(self, x, y):
+        """
+        Append rows at the end.
+        :param x: sparse matrix with n_features columns
+        :param y: one label per row
+        """
+        x = csr_matrix(x)
+        if x.shape[1] != self.n_features:
+            raise ValueError('expected {} features, got {}'.format(self.n_features, x.shape[1]))
+        y = np.asarray(y, dtype=self.y.dtype)
+        n_rows, nnz = x.shape[0], x.nnz
+        if len(y) != n_rows:
+            raise ValueError('expected {} labels, got {}'.format(n_rows, len(y)))
+
+        rows_end, nnz_end = self.n_rows + n_rows, self.nnz + nnz
+        if rows_end > len(self.y):
+            self.indptr = self._grow(self.indptr, rows_end + 1)
+            self.y = self._grow(self.y, rows_end)
+        if nnz_end > len(self.data):
+            self.data = self._grow(self.data, nnz_end)
+            self.indices = self._grow(self.indices, nnz_end)
+        if nnz_end > np.iinfo(self.indptr.dtype).max:
+            self.indices = self.indices.astype(np.int64)
+            self.indptr = self.indptr.astype(np.int64)
+
+        self.data[self.nnz:nnz_end] = x.data
+        self.indices[self.nnz:nnz_end] = x.indices
+        self.indptr[self.n_rows + 1:rows_end + 1] = x.indptr[1:] + self.nnz
+        self.y[self.n_rows:rows_end] = y
+        self.n_rows, self.nnz = rows_end, nnz_end
+
+    def rows(self, start=0, end=None):
+        """
+        CSR matrix of the rows start to end. data and indices are views of the buffer, only the
+        row pointers are copied if start > 0.
+        :param start: first row
+        :param end: row after the last row, default all rows
+        :return: csr_matrix
+        """
+        end = self.n_rows if end is None else min(end, self.n_rows)
+        start = min(start, end)
+        first, last = self.indptr[start], self.indptr[end]
+        indptr = self.indptr[start:end + 1]
+        if first:
+            indptr = indptr - first
+        return csr_matrix((self.data[first:last], self.indices[first:last], indptr),
+                          shape=(end - start, self.n_features), copy=False)
+
+    def labels(self, start=0, end=None):
+        """
+        :param start: first row
+        :param end: row after the last row, default all rows
+        :return: view of the labels of the rows start to end
+        """
+        end = self.n_rows if end is None else min(end, self.n_rows)
+        return self.y[min(start, end):end]
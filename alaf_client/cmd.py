@@ -1,20 +1,61 @@
 import argparse
+import os
 from example import LeastConfidenceALModel, RandomALModel, get_dataset
+from learners import learners
 
 
 # python cmd.py -project project1 -name model1 -host localhost -port 5000 -model svm_random -data_dir ./data/example/ -output_dir ./models/
 
-def start(project_name, name, host, port, model_cls, data_dir, output_dir, simulation=False, batch_size=1024, n_jobs=-1):
-
-    model_cls(dataset_func=lambda: get_dataset(data_dir),
-              output_dir=output_dir,
-              project_name=project_name,
-              name=name,
-              host=host,
-              port=port,
-              simulation=simulation,
-              batch_size=batch_size,
-              n_jobs=n_jobs)
+def start(project_name, name, host, port, model_cls, data_dir, output_dir, simulation=False, batch_size=1024, n_jobs=-1,
+          learner='svc', max_staleness=0, seed=0, eval_every=1, eval_growth=None,
+          log_flush_every=1, log_fsync=False, transport=None):
+
+    return model_cls(dataset_func=lambda: get_dataset(data_dir, cache_dir=os.path.join(output_dir, 'cache')),
+                     output_dir=output_dir,
+                     project_name=project_name,
+                     name=name,
+                     host=host,
+                     port=port,
+                     simulation=simulation,
+                     batch_size=batch_size,
+                     n_jobs=n_jobs,
+                     learner=learner,
+                     max_staleness=max_staleness,
+                     seed=seed,
+                     eval_every=eval_every,
+                     eval_growth=eval_growth,
+                     log_flush_every=log_flush_every,
+                     log_fsync=log_fsync,
+                     transport=transport)
+
+
+def start_async(project_name, names, host, port, *args, **kwargs):
+    """
+    Start one model per name and drive all of them on one asyncio event loop.
+    Same arguments as start, but a list of model names.
+    """
+    from alaf_client import aio
+
+    transports = list()
+    for name in names:
+        transport = aio.AsyncTransport(host, port)
+        start(project_name, name, host, port, *args, transport=transport, **kwargs)
+        transports.append(transport)
+    aio.run(transports)
+
+
+def start_headless(results_file, max_count, round_size, project_name, name, host, port, model_cls, data_dir,
+                   output_dir, simulation=True, *args):
+    """
+    Simulate the model in this process without server, see alaf_client.simulate. Same arguments as start
+    after the results file, the number of annotations to simulate and the utterances per round.
+    """
+    from alaf_client import simulate
+
+    def build(transport, **kwargs):
+        return start(project_name, name, host, port, model_cls, data_dir, output_dir, True, *args, transport=transport)
+
+    simulate.run(build, results_file, max_count, round_size, project_name=project_name, name=name)
 
 
 if __name__ == '__main__':
@@ -23,8 +64,8 @@ if __name__ == '__main__':
     parser.add_argument('-project', type=str,
                         help='Project name')
 
-    parser.add_argument('-name', type=str,
-                        help='Model/Client name')
+    parser.add_argument('-name', type=str, nargs='+',
+                        help='Model/Client name, several names with -asyncio')
 
     parser.add_argument('-host', type=str, default='localhost',
                         help='Host ip/url')
@@ -51,20 +92,70 @@ if __name__ == '__main__':
     parser.add_argument('-n_jobs', type=int, default=-1,
                         help='number of parallel processes.')
 
+    parser.add_argument('-learner', type=str, default='svc', choices=sorted(learners),
+                        help='learner backend of the svm models. svc retrains from scratch (svc_margin is the same), '
+                             'sgd updates online, logistic is warm started')
+
+    parser.add_argument('-max_staleness', type=int, default=0,
+                        help='number of annotations the model used for selection may lag behind. '
+                             'With 0 selection waits for retraining, higher values retrain in the background')
+
+    parser.add_argument('-seed', type=int, default=0,
+                        help='seed of the svm_random selection order')
+
+    parser.add_argument('-eval_every', type=int, default=1,
+                        help='number of annotations between two evaluations on the test set')
+
+    parser.add_argument('-eval_growth', type=float, default=None,
+                        help='evaluate at log spaced counts instead, e.g. 1.1 evaluates whenever the number '
+                             'of annotations grew by 10%%')
+
+    parser.add_argument('-log_flush_every', type=int, default=1,
+                        help='number of annotations written before the annotation log is flushed')
+
+    parser.add_argument('-log_fsync', action='store_true',
+                        help='force the annotation log to disk on every flush, survives a crash of the machine')
+
+    parser.add_argument('-asyncio', action='store_true',
+                        help='drive all models given by -name in this process on one asyncio event loop')
+
+    parser.add_argument('-headless', type=str, metavar='RESULTS_FILE',
+                        help='simulate without server in this process and write times and scores to this .npz '
+                             'file, import it with the import endpoint of the server')
+
+    parser.add_argument('-max_count', type=int, default=1000,
+                        help='number of annotations to simulate with -headless')
+
+    parser.add_argument('-round_size', type=int, default=1,
+                        help='utterances per round with -headless')
+
     args = parser.parse_args()
+    if len(args.name) > 1 and not args.asyncio:
+        parser.error('several model names need -asyncio')
     model = None
     if args.model == 'svm_random':
         model = RandomALModel
     elif args.model == 'svm_least':
         model = LeastConfidenceALModel
 
-    start(args.project,
-          args.name,
-          args.host,
-          args.port,
-          model,
-          args.data_dir,
-          args.output_dir,
-          args.simulation,
-          args.batch_size,
-          args.n_jobs)
+    start_args = [args.host,
+                  args.port,
+                  model,
+                  args.data_dir,
+                  args.output_dir,
+                  args.simulation,
+                  args.batch_size,
+                  args.n_jobs,
+                  args.learner,
+                  args.max_staleness,
+                  args.seed,
+                  args.eval_every,
+                  args.eval_growth,
+                  args.log_flush_every,
+                  args.log_fsync]
+    if args.headless:
+        start_headless(args.headless, args.max_count, args.round_size, args.project, args.name[0], *start_args)
+    elif args.asyncio:
+        start_async(args.project, args.name, *start_args)
+    else:
+        start(args.project, args.name[0], *start_args)
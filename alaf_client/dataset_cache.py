@@ -0,0 +1,143 @@
+from scipy.sparse import csr_matrix
+import numpy as np
+from hashlib import blake2b
+import hashlib
+import json
+import os
+import shutil
+
+# increase if the layout of the cache changes
+cache_version = 2
+
+
+def temporary_path(path):
+    """
+    Name to write path under before it is moved in place. Unique per process, so several clients
+    filling the same cache at once do not write into the same temporary file.
+    :param path: final path
+    :return: path
+    """
+    return '{}.{}.tmp'.format(path, os.getpid())
+
+
+def content_hash(path, cache_dir):
+    """
+    Hash of the file content. Remembered per path, size and modification time in cache_dir so
+    unchanged files are not read again.
+    :param path: file
+    :param cache_dir: cache folder
+    :return: hex digest
+    """
+    memo_file = os.path.join(cache_dir, 'file_hashes.json')
+    memo = dict()
+    if os.path.exists(memo_file):
+        with open(memo_file) as f:
+            memo = json.load(f)
+
+    stat = os.stat(path)
+    path = os.path.abspath(path)
+    entry = memo.get(path)
+    if entry is not None and entry[0] == stat.st_size and entry[1] == stat.st_mtime_ns:
+        return entry[2]
+
+    h = blake2b()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    memo[path] = [stat.st_size, stat.st_mtime_ns, h.hexdigest()]
+
+    os.makedirs(cache_dir, exist_ok=True)
+    tmp = temporary_path(memo_file)
+    with open(tmp, 'w') as f:
+        json.dump(memo, f)
+    os.replace(tmp, memo_file)
+    return h.hexdigest()
+
+
+def dataset_key(files, vectorizer, cache_dir):
+    """
+    Key of a dataset from the content of its files and the settings of the (unfitted) vectorizer.
+    :param files: dict name -> path, missing files are None
+    :param vectorizer: CountVectorizer
+    :param cache_dir: cache folder
+    :return: hex digest
+    """
+    h = hashlib.sha1('alaf dataset v{}\n'.format(cache_version).encode('utf-8'))
+    for name, path in sorted(files.items()):
+        digest = content_hash(path, cache_dir) if path is not None else '-'
+        h.update('{}:{}\n'.format(name, digest).encode('utf-8'))
+    params = sorted((k, repr(v)) for k, v in vectorizer.get_params().items())
+    h.update(repr(params).encode('utf-8'))
+    return h.hexdigest()
+
+
+def save_dataset(directory, vectorizer, matrices, arrays, extra):
+    """
+    Write a dataset into the cache. Written into a temporary folder which is renamed when complete.
+    If another process stored the same dataset in the meantime, its folder is kept.
+    :param directory: cache folder of the dataset
+    :param vectorizer: fitted CountVectorizer
+    :param matrices: dict name -> sparse matrix, saved as CSR data/indices/indptr
+    :param arrays: dict name -> numpy array
+    :param extra: json serializable dict stored in meta.json
+    """
+    tmp = temporary_path(directory)
+    shutil.rmtree(tmp, ignore_errors=True)
+    os.makedirs(tmp)
+
+    # terms in order of their column
+    terms = [None] * len(vectorizer.vocabulary_)
+    for term, index in vectorizer.vocabulary_.items():
+        terms[index] = term
+    with open(os.path.join(tmp, 'vocabulary.json'), 'w') as f:
+        json.dump(terms, f)
+
+    shapes = dict()
+    for name, matrix in matrices.items():
+        matrix = csr_matrix(matrix)
+        for part in ('data', 'indices', 'indptr'):
+            np.save(os.path.join(tmp, '{}.{}.npy'.format(name, part)), getattr(matrix, part))
+        shapes[name] = list(matrix.shape)
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+
+    with open(os.path.join(tmp, 'meta.json'), 'w') as f:
+        json.dump(dict(extra, matrices=shapes, arrays=sorted(arrays)), f)
+
+    try:
+        os.replace(tmp, directory)
+    except OSError:
+        # a complete folder has meta.json, it is the same dataset stored by another process
+        if not os.path.exists(os.path.join(directory, 'meta.json')):
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp, directory)
+            return
+        shutil.rmtree(tmp, ignore_errors=True)
+
+
+def load_dataset(directory, vectorizer_cls, vectorizer_params):
+    """
+    Load a dataset from the cache. Matrices and arrays are memory mapped read-only.
+    :param directory: cache folder of the dataset
+    :param vectorizer_cls: class of the vectorizer, e.g. CountVectorizer
+    :param vectorizer_params: settings of the vectorizer
+    :return: vectorizer, dict name -> matrix, dict name -> array, extra dict; None if not cached
+    """
+    meta_file = os.path.join(directory, 'meta.json')
+    if not os.path.exists(meta_file):
+        return None
+    with open(meta_file) as f:
+        meta = json.load(f)
+
+    with open(os.path.join(directory, 'vocabulary.json')) as f:
+        terms = json.load(f)
+    vectorizer = vectorizer_cls(**dict(vectorizer_params, vocabulary={term: i for i, term in enumerate(terms)}))
+
+    def load(name):
+        return np.load(os.path.join(directory, name + '.npy'), mmap_mode='r')
+
+    matrices = {name: csr_matrix((load(name + '.data'), load(name + '.indices'), load(name + '.indptr')),
+                                 shape=tuple(shape), copy=False)
+                for name, shape in meta.pop('matrices').items()}
+    arrays = {name: load(name) for name in meta.pop('arrays')}
+    return vectorizer, matrices, arrays, meta
@@ -1,13 +1,47 @@
 from alaf_client.base import BaseALModel
+from learners import get_learner, learners
+from selection import least_confident
+from dataset_cache import content_hash, dataset_key, load_dataset, save_dataset, temporary_path
+from buffers import SparseRowBuffer
+from annotation_log import AnnotationLog
+from pool import get_pool_matrix, get_pool_index, file_key, line_offsets, PoolMatrix, SelectedRows, PoolText, \
+    PermutationSampler, init_worker, worker_matrix, worker_selected
 
 from sklearn.feature_extraction.text import CountVectorizer
 import fileinput
-from sklearn.svm import SVC
 from sklearn.metrics import precision_score, recall_score, f1_score
-from scipy.sparse import vstack
 import os
-from random import choice
+import json
+from copy import deepcopy
 import multiprocessing as mp
+from multiprocessing.pool import ThreadPool
+import numpy as np
+
+# annotation of instances the annotator skipped
+skip_annotation = -1
+
+
+def read_json(path):
+    """
+    :param path: json file
+    :return: content, None if the file does not exist or is not valid json
+    """
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def write_json(path, content):
+    """
+    Write a json file under a temporary name and move it in place, a crash never leaves a partly written file.
+    :param path: json file
+    :param content: json serializable
+    """
+    with open(temporary_path(path), 'w') as f:
+        json.dump(content, f)
+    os.replace(temporary_path(path), path)
 
 
 class SvmALModel(BaseALModel):
@@ -20,7 +54,16 @@ class SvmALModel(BaseALModel):
                  port=5000,
                  simulation=False,
                  batch_size=1024,
-                 n_jobs=-1):
+                 n_jobs=-1,
+                 learner='svc',
+                 max_staleness=0,
+                 cache_dir=None,
+                 seed=0,
+                 eval_every=1,
+                 eval_growth=None,
+                 log_flush_every=1,
+                 log_fsync=False,
+                 transport=None):
         """
         Base class for SVM based active learning methods. Handles the SVM model and training and newly
         annotated instances.
@@ -33,40 +76,69 @@ class SvmALModel(BaseALModel):
         :param simulation: simulation mode
         :param batch_size: batch size for multiprocess dataset handling
         :param n_jobs: number of parallel processes
+        :param learner: learner backend: svc, svc_margin, sgd or logistic
+        :param max_staleness: number of annotations the model used for selection may lag behind the
+        annotations, training runs in the background meanwhile
+        :param cache_dir: folder for the vectorized pool, default output_dir/cache
+        :param seed: seed for random selection
+        :param eval_every: number of annotations between two evaluations on the test set
+        :param eval_growth: evaluate at log spaced counts, factor between two evaluated counts
+        :param log_flush_every: number of annotations written before the annotation log is flushed
+        :param log_fsync: force the flushed annotations to disk
+        :param transport: e.g. aio.AsyncTransport, default the blocking socketIO client
         """
         self.output_dir = output_dir
+        self.cache_dir = cache_dir or os.path.join(output_dir, 'cache')
         self.batch_size = batch_size
+        self.learner = learner
+        self.seed = seed
 
         project_model_name = '{}.{}'.format(project_name, name)
         self.model_dir = os.path.join(self.output_dir, project_model_name)
         os.makedirs(self.model_dir, exist_ok=True)
 
         self.dataset = dataset_func()
+        self.pool_text = PoolText(self.dataset['pool_file'], self.dataset['pool_file_offsets'])
+        # utterances are identified by pool row, selected rows are kept in a bitmask next to the annotation log
+        self.pool_index = get_pool_index(self.dataset['pool_file'], self.cache_dir)
+
+        # annotated instances by pool row, older versions wrote alaf.txt and alaf_annotation.txt
+        self.annotation_log_file = os.path.join(self.model_dir, 'annotations.log')
         self.alaf_file = os.path.join(self.model_dir, 'alaf.txt')
         self.alaf_annotation_file = os.path.join(self.model_dir, 'alaf_annotation.txt')
-        with open(self.alaf_file, 'a'):
-            pass
-        with open(self.alaf_annotation_file, 'a'):
-            pass
+        self.annotation_log = self.open_annotation_log(log_flush_every, log_fsync)
 
-        alaf_lines = [l.rstrip() for l in open(self.alaf_file).readlines()]
-        x_alaf = self.dataset['vectorizer'].transform(alaf_lines)
-        y_alaf = [int(l.rstrip()) for l in open(self.alaf_annotation_file).readlines()]
-        self.alaf_lines = set(alaf_lines)
+        # initial training data followed by the annotated instances, grows with every annotation
+        x_train, y_train = self.dataset['x_train'], self.dataset['y_train']
+        self.training_data = SparseRowBuffer(x_train.shape[1], label_dtype=y_train.dtype,
+                                             capacity=2 * x_train.shape[0], nnz_capacity=2 * x_train.nnz)
+        self.training_data.append(x_train, y_train)
+        self.n_train = x_train.shape[0]
+        self.training_data.append(*self.load_annotations())
 
-        self.dataset.update(dict(x_alaf=x_alaf, y_alaf=y_alaf))
+        self.count = len(self.annotation_log)
 
-        self.count = len(self.dataset['y_alaf'])
-        self.trained_model = self.get_ml_model()
+        self.selected_rows_file = os.path.join(self.model_dir, 'selected_rows.bits')
+        self.selected_rows_meta_file = os.path.join(self.model_dir, 'selected_rows.json')
+        self.load_selected_rows()
+        # number of rows of the training buffer already handed to the training worker
+        self._snapshot_count = self.n_train
 
         self.n_jobs = n_jobs if n_jobs > 0 else mp.cpu_count()
-        self.mp_pool = mp.Pool(n_jobs if n_jobs > 0 else mp.cpu_count())
+        initializer, initargs = self.get_worker_init()
+        self.mp_pool = mp.Pool(self.n_jobs, initializer=initializer, initargs=initargs)
+        # the test set is predicted in chunks by threads, sparse products release the GIL
+        self.eval_pool = ThreadPool(self.n_jobs)
 
         super(SvmALModel, self).__init__(project_name=project_name,
                                          name=name,
                                          host=host,
                                          port=port,
-                                         simulation=simulation)
+                                         simulation=simulation,
+                                         max_staleness=max_staleness,
+                                         eval_every=eval_every,
+                                         eval_growth=eval_growth,
+                                         transport=transport)
 
     def add_instance(self, utterance, annotation):
         """
@@ -76,54 +148,186 @@ class SvmALModel(BaseALModel):
         :param annotation: human annotation
         :return:
         """
-        vectorizer = self.dataset['vectorizer']
-        x_utterance = vectorizer.transform([utterance])
-        if self.get_count() == 0:
-            self.dataset['x_alaf'] = x_utterance
-            self.dataset['y_alaf'] = [annotation]
-        else:
-            self.dataset['x_alaf'] = vstack([self.dataset['x_alaf'], x_utterance])
-            self.dataset['y_alaf'] += [annotation]
-
-        with open(self.alaf_file, 'a') as f:
-            f.write(utterance + '\n')
-        self.alaf_lines.add(utterance)
-        with open(self.alaf_annotation_file, 'a') as f:
-            f.write(str(annotation) + '\n')
-
-        self.count += 1
-        self.trained_model = self.get_ml_model()
+        self.add_instances([utterance], [annotation])
 
-    def get_ml_model(self):
+    def add_instances(self, utterances, annotations):
         """
-        Instantiate and train SVM with all available training data.
-        :return: trained SVM
+        Batch mode. Adds all instances of a round to the training instances. The learner is retrained
+        once by the training worker. Skipped instances (annotation -1) are logged and not selected again,
+        but not trained on, they would add a class the learners do not know.
+        :param utterances: list of text
+        :param annotations: list of human annotations
+        :return:
         """
-        ml_model = SVC(kernel='linear', probability=True)
-        x_train, y_train = self.dataset['x_train'], self.dataset['y_train']
+        trained = [i for i, annotation in enumerate(annotations) if annotation != skip_annotation]
+        if trained:
+            self.training_data.append(self.dataset['vectorizer'].transform([utterances[i] for i in trained]),
+                                      [annotations[i] for i in trained])
+
+        records = list()
+        for utterance, annotation in zip(utterances, annotations):
+            rows = self.pool_index.rows_of(utterance)
+            self.selected_rows.add(rows)
+            if len(rows):
+                records.append((int(rows[0]), int(annotation), None))
+            else:
+                records.append((-1, int(annotation), utterance))
+        self.annotation_log.append(records)
+        self.count += len(utterances)
+        self.save_selected_rows()
+
+    def open_annotation_log(self, flush_every, fsync):
+        """
+        Open the annotation log of this model. It is created from alaf.txt and alaf_annotation.txt of
+        older versions if they exist. The log refers to pool rows, it must not be used with another pool.
+        :param flush_every: number of annotations written before the log is flushed
+        :param fsync: force the flushed annotations to disk
+        :return: AnnotationLog
+        """
+        meta_file = self.annotation_log_file + '.json'
+        meta = {'pool': content_hash(self.dataset['pool_file'], self.cache_dir)}
+        if os.path.exists(self.annotation_log_file):
+            stored = read_json(meta_file)
+            if stored is None:
+                print('{} is missing or corrupt, assume the log belongs to {}'.format(meta_file,
+                                                                                     self.dataset['pool_file']))
+                write_json(meta_file, meta)
+            elif stored != meta:
+                raise ValueError('{} belongs to another pool file than {}'.format(self.annotation_log_file,
+                                                                                    self.dataset['pool_file']))
+            return AnnotationLog(self.annotation_log_file, flush_every, fsync)
+
+        write_json(meta_file, meta)
+        if os.path.exists(self.alaf_file) and os.path.exists(self.alaf_annotation_file):
+            return AnnotationLog.migrate(self.annotation_log_file, self.alaf_file, self.alaf_annotation_file,
+                                         self.pool_index.rows_of, flush_every=flush_every, fsync=fsync)
+        return AnnotationLog(self.annotation_log_file, flush_every, fsync)
+
+    def annotated_utterances(self, records=None):
+        """
+        :param records: records of the annotation log, default all
+        :return: generator of the annotated utterances in the order of the annotation log
+        """
+        for record in self.annotation_log.records if records is None else records:
+            yield record.text if record.row < 0 else self.read_pool_line(record.row)
 
-        if self.get_count() > 0:
-            x_alaf, y_alaf = self.dataset['x_alaf'], self.dataset['y_alaf']
-            x_train = vstack([x_train, x_alaf])
-            y_train = y_train + y_alaf
+    def load_annotations(self):
+        """
+        Features and labels of the annotated instances in the annotation log. Taken from the cached
+        pool matrix if it exists, otherwise only the annotated utterances are vectorized.
+        Skipped instances are left out.
+        :return: sparse matrix, list of labels
+        """
+        records = [record for record in self.annotation_log.records if record.label != skip_annotation]
+        rows = [record.row for record in records]
+        labels = [record.label for record in records]
+        pool_matrix_dir = get_pool_matrix(self.dataset['pool_file'], self.dataset['vectorizer'], self.cache_dir,
+                                          key=self.dataset.get('key'), build=False)
+        if pool_matrix_dir is not None and min(rows, default=0) >= 0:
+            return PoolMatrix(pool_matrix_dir).take(rows), labels
+        return self.dataset['vectorizer'].transform(self.annotated_utterances(records)), labels
+
+    def get_training_data(self):
+        """
+        Initial training data together with all annotated instances. Views of the training buffer,
+        later annotations do not change them.
+        :return: features, labels
+        """
+        return self.training_data.rows(), self.training_data.labels()
 
-        ml_model.fit(x_train, y_train)
-        return ml_model
+    @property
+    def trained_model(self):
+        """
+        Most recently trained learner.
+        """
+        return self.model_handle.model
 
-    def get_scores(self):
+    def training_snapshot(self):
+        """
+        Instances annotated since the last snapshot. Incremental learners only need those,
+        the others get all available training data.
+        :return: dict with x, y, x_new, y_new
         """
-        Get scores of SVM on test set.
+        start, self._snapshot_count = self._snapshot_count, len(self.training_data)
+        x_new = self.training_data.rows(start)
+        y_new = self.training_data.labels(start)
+        if self.trained_model is not None and learners[self.learner].incremental:
+            return dict(x=None, y=None, x_new=x_new, y_new=y_new)
+        x_train, y_train = self.get_training_data()
+        return dict(x=x_train, y=y_train, x_new=x_new, y_new=y_new)
+
+    def train(self, snapshot):
+        """
+        Train the learner backend. The first model is trained from scratch, afterwards a copy of the
+        current model is updated because selection may still use it.
+        :param snapshot: return value of training_snapshot
+        :return: trained learner
+        """
+        model = self.trained_model
+        if model is None:
+            return get_learner(self.learner).fit(snapshot['x'], snapshot['y'])
+        if len(snapshot['y_new']) == 0:
+            return model
+        return deepcopy(model).update(snapshot['x'], snapshot['y'], snapshot['x_new'], snapshot['y_new'])
+
+    def get_scores(self, model=None):
+        """
+        Get scores of the learner on test set. The test set is predicted in chunks of at least
+        batch_size rows in parallel.
+        :param model: learner to evaluate, default the most recently trained one
         :return: precision, recall, f1
         """
+        if model is None:
+            model = self.trained_model
         x_test, y_test = self.dataset['x_test'], self.dataset['y_test']
 
-        y_pred = self.trained_model.predict(x_test)
+        rows = x_test.shape[0]
+        n = max(-(-rows // self.n_jobs), self.batch_size)
+        chunks = [x_test[i:i + n] for i in range(0, rows, n)]
+        y_pred = np.concatenate(self.eval_pool.map(model.predict, chunks))
         precision = precision_score(y_test, y_pred)
         recall = recall_score(y_test, y_pred)
         f1 = f1_score(y_test, y_pred)
 
         return precision, recall, f1
 
+    def load_selected_rows(self):
+        """
+        Open the bitmask of selected pool rows. It is rebuilt from the annotation log if it belongs to
+        another pool file or does not match the annotated instances, e.g. after a crash.
+        """
+        self.selected_rows = SelectedRows(self.selected_rows_file, len(self.pool_index))
+        if read_json(self.selected_rows_meta_file) != self._selected_rows_meta():
+            self.selected_rows.clear()
+            for utterance in self.annotated_utterances():
+                self.selected_rows.add(self.pool_index.rows_of(utterance))
+            self.save_selected_rows()
+
+    def _selected_rows_meta(self):
+        return {'pool': file_key(self.dataset['pool_file']), 'count': self.count}
+
+    def save_selected_rows(self):
+        """
+        Write the bitmask of selected rows to disk, together with the pool and count it belongs to.
+        """
+        self.selected_rows.flush()
+        write_json(self.selected_rows_meta_file, self._selected_rows_meta())
+
+    def get_worker_init(self):
+        """
+        Override this to set up the processes of mp_pool once, e.g. to open shared data.
+        :return: initializer function, arguments
+        """
+        return None, ()
+
+    def read_pool_line(self, idx):
+        """
+        Read one utterance from the pool file.
+        :param idx: line index
+        :return: utterance
+        """
+        return self.pool_text.line(idx)
+
     def get_next_utterance(self, prev_annotation=None):
         """
         Override this with actual active learning algorithm
@@ -149,109 +353,136 @@ class LeastConfidenceALModel(SvmALModel):
         """
         super(LeastConfidenceALModel, self).__init__(*args, **kwargs)
 
+    def get_worker_init(self):
+        """
+        Vectorize the pool once into a memory mapped matrix which every worker opens in its initializer.
+        The workers also map the bitmask of selected rows, they see new selections without messages.
+        :return: initializer function, arguments
+        """
+        pool_matrix_dir = get_pool_matrix(self.dataset['pool_file'], self.dataset['vectorizer'], self.cache_dir,
+                                          key=self.dataset.get('key'))
+        return init_worker, (pool_matrix_dir, self.selected_rows_file, len(self.pool_index))
+
     @staticmethod
     def _get_next_utterance_mp(args):
         """
-        Started in a own process. Works on a slice of the whole pool file and returns the local least
-        confident utterance together with its confidence score.
+        Started in a own process. Scores a slice of the memory mapped pool matrix with the weights of the
+        linear model and returns the k local least confident rows together with their confidence scores.
+        Rows which have already been selected are masked out.
         :param args:
-        :return: utterance, confidence, label
+        :return: list of row, confidence
         """
-        ml_model, alaf_lines, pool_file, offsets, vectorizer, pool_labels, start, end = args
-
-        ml_model.confidence = lambda x: [max(v) for v in ml_model.predict_proba(x)]
-
-        lines_pool = list()
-        # jump into file based on offset this process is working on
-        with open(pool_file) as f:
-            f.seek(offsets[start])
-            for i, line in enumerate(f):
-                lines_pool.append(line.rstrip())
-                if i+start == end:
-                    break
-
-        x_pool = vectorizer.transform(lines_pool)
-        confidence = None
-        idx = None
-
-        confs = ml_model.confidence(x_pool)
-        for i, c in enumerate(confs):
-            # check if current line idx has lowest confidence and if the line has not already been selected
-            if (idx is None or c < confidence) and lines_pool[i] not in alaf_lines:
-                confidence = c
-                idx = i
-
-        if idx is None:
-            raise ValueError('no unseen pool instances left')
-        utterance = lines_pool[idx]
-        label = pool_labels[idx + start] if pool_labels else None
-
-        return utterance, confidence, label
+        coef, intercept, start, end, k, block_size = args
+        rows, confs = least_confident(worker_matrix(), coef, intercept, start, end, worker_selected(), k, block_size)
+        return list(zip(rows.tolist(), confs.tolist()))
 
     def get_next_utterance(self, prev_annotation=None):
         """
-        Separates the pool file into smaller chunks and sent them to different processes.
         Find the utterance with the lowest confidence score across the whole pool file.
         :return: utterance, label/None
         """
+        return self.get_next_utterances(1, prev_annotation)[0]
 
-        # create start and end line idx for portion of pool file each process handles
-        inp = len(self.dataset['pool_file_offsets'])
-        n = self.batch_size
-        chunks = [(i, min(i+n-1, inp-1)) for i in range(0, inp, n)]
+    def get_next_utterances(self, k, prev_annotation=None):
+        """
+        Separates the pool matrix into one slice per task and sends them to different processes together
+        with the weights of the current model. Find the k distinct utterances with the lowest confidence
+        scores across the whole pool.
+        :param k: number of utterances
+        :return: list of utterance, label/None
+        """
+        coef, intercept = self.trained_model.weights()
+        pool_labels = self.dataset.get('pool_labels')  # default None
 
-        args = [(self.trained_model,
-                 self.alaf_lines,
-                 self.dataset['pool_file'],
-                 self.dataset['pool_file_offsets'],
-                 self.dataset['vectorizer'],
-                 self.dataset.get('pool_labels'),  # default None
-                 start,
-                 end)
-                for start, end in chunks]
-        results = self.mp_pool.map(LeastConfidenceALModel._get_next_utterance_mp, args)
-        utterance, _, label = sorted(results, key=lambda e: e[1])[0]
+        # a few tasks per process, the weights are sent with every task
+        inp = len(self.dataset['pool_file_offsets'])
+        n = max(-(-inp // (self.n_jobs * 4)), 1)
+        chunks = [(i, min(i + n, inp)) for i in range(0, inp, n)]
+
+        selected = list()
+        seen = set()
+        while len(selected) < k:
+            args = [(coef, intercept, start, end, k - len(selected), self.batch_size) for start, end in chunks]
+            results = self.mp_pool.map(LeastConfidenceALModel._get_next_utterance_mp, args)
+            candidates = sorted((r for chunk in results for r in chunk), key=lambda e: e[1])
+            if not candidates:
+                break
+
+            for row, _ in candidates:
+                utterance = self.read_pool_line(row)
+                # the pool can contain the same line several times, mark all of them
+                self.selected_rows.add(row)
+                self.selected_rows.add(self.pool_index.rows_of(utterance))
+                if utterance in seen:
+                    continue
+                seen.add(utterance)
+                selected.append((utterance, int(pool_labels[row]) if pool_labels is not None else None))
+                if len(selected) == k:
+                    break
 
-        return utterance, label
+        if not selected:
+            raise ValueError('no unseen pool instances left')
+        return selected
 
 
 class RandomALModel(SvmALModel):
 
     def __init__(self, *args, **kwargs):
         """
-        Randomly selects an utterance from the pool file.
+        Randomly selects utterances from the pool file. Rows are drawn without replacement from a seeded
+        permutation of the pool which is stored in the model folder, restarts continue the permutation.
         :param args:
         :param kwargs:
         """
+        self._sampler = None
         super(RandomALModel, self).__init__(*args, **kwargs)
 
+    @property
+    def sampler(self):
+        if self._sampler is None:
+            self._sampler = PermutationSampler(self.model_dir, len(self.pool_text), self.seed)
+        return self._sampler
+
     def get_next_utterance(self, prev_annotation=None):
         """
-        Read an utterance from the pool file by randomly selecting a line start position.
+        Read the next utterance of the permutation which has not been selected yet.
         :return: utterance, label
         """
-        utterance = None
-        while utterance is None or utterance in self.alaf_lines:
-            idx = choice(range(len(self.dataset['pool_file_offsets'])))
-            offset = self.dataset['pool_file_offsets'][idx]
-            with open(self.dataset['pool_file']) as f:
-                f.seek(offset)
-                line = f.readline()
-            utterance = line.rstrip()
+        return self.get_next_utterances(1, prev_annotation)[0]
 
-        label = None
-        if 'pool_labels' in self.dataset:
-            label = self.dataset['pool_labels'][idx]
-
-        return utterance, label
+    def get_next_utterances(self, k, prev_annotation=None):
+        """
+        Batch mode. Randomly select k distinct utterances from the pool file.
+        :param k: number of utterances
+        :return: list of utterance, label
+        """
+        pool_labels = self.dataset.get('pool_labels')  # default None
+        selected = list()
+        while len(selected) < k:
+            row = self.sampler.next(self.selected_rows)
+            if row is None:
+                break
+            utterance = self.read_pool_line(row)
+            # the pool can contain the same line several times, mark all of them
+            self.selected_rows.add(self.pool_index.rows_of(utterance))
+            selected.append((utterance, int(pool_labels[row]) if pool_labels is not None else None))
+        self.sampler.save()
+
+        if not selected:
+            raise ValueError('no unseen pool instances left')
+        return selected
 
 
-def get_dataset(data_dir):
+def get_dataset(data_dir, cache_dir=None):
     """
     Read dataset from provided data_dir. One line per utterance and one label per line in a separate file
     for train, dev, test and (both if possible) pool. Named x.txt and x_label.txt
     Features are extracted as one-hot vectors representing uni grams.
+    Labels are int8 (up to 128 classes) and pool offsets int64 numpy arrays. With cache_dir the
+    vocabulary, matrices, labels and pool offsets are stored in the cache, keyed by the content
+    of the files and the vectorizer settings, and memory mapped on the next start.
     :param data_dir: path to data folder like SST-2
+    :param cache_dir: cache folder, None to disable caching
     :return: dict with train, dev, test, pool data and feature extractor
     """
     print('load dataset from: {}'.format(data_dir))
@@ -264,46 +495,60 @@ def get_dataset(data_dir):
 
     pool_file = os.path.join(data_dir, 'pool.txt')
     pool_label_file = os.path.join(data_dir, 'pool_label.txt')
+    if not os.path.exists(pool_label_file):
+        pool_label_file = None
 
     vectorizer = CountVectorizer()
-    vectorizer.fit(fileinput.input([train_file, pool_file]))
-
-    def get_labels(filename):
-        return [int(l.rstrip('/n')) for l in open(filename).readlines()]
-
-    x_train = vectorizer.transform(open(train_file))
-    y_train = get_labels(train_label_file)
-    x_dev = vectorizer.transform(open(dev_file))
-    y_dev = get_labels(dev_label_file)
-    x_test = vectorizer.transform(open(test_file))
-    y_test = get_labels(test_label_file)
-
-    # needed for efficient file navigation
-    pool_file_offsets = []
-    offset = 0
-    with open(pool_file, 'rb') as f:
-        for line in f:
-            pool_file_offsets.append(offset)
-            offset += len(line)
+
+    key = None
+    cached = None
+    if cache_dir is not None:
+        files = dict(train=train_file, train_label=train_label_file,
+                     dev=dev_file, dev_label=dev_label_file,
+                     test=test_file, test_label=test_label_file,
+                     pool=pool_file, pool_label=pool_label_file)
+        key = dataset_key(files, vectorizer, cache_dir)
+        directory = os.path.join(cache_dir, 'dataset_' + key)
+        cached = load_dataset(directory, CountVectorizer, vectorizer.get_params())
+
+    if cached is not None:
+        print('dataset from cache: {}'.format(directory))
+        vectorizer, matrices, arrays, _ = cached
+    else:
+        vectorizer.fit(fileinput.input([train_file, pool_file]))
+
+        def get_labels(filename):
+            with open(filename) as f:
+                return np.array(f.read().split(), dtype=np.int64).astype(np.int8)
+
+        matrices = dict(x_train=vectorizer.transform(open(train_file)),
+                        x_dev=vectorizer.transform(open(dev_file)),
+                        x_test=vectorizer.transform(open(test_file)))
+        arrays = dict(y_train=get_labels(train_label_file),
+                      y_dev=get_labels(dev_label_file),
+                      y_test=get_labels(test_label_file))
+
+        # needed for efficient file navigation
+        arrays['pool_file_offsets'] = line_offsets(pool_file)
+
+        if pool_label_file is not None:
+            arrays['pool_labels'] = get_labels(pool_label_file)
+
+        if cache_dir is not None:
+            save_dataset(directory, vectorizer, matrices, arrays, {})
 
     dataset = dict(vectorizer=vectorizer,
-                   x_train=x_train, y_train=y_train,
-                   x_dev=x_dev, y_dev=y_dev,
-                   x_test=x_test, y_test=y_test,
                    pool_file=pool_file,
-                   pool_file_offsets=pool_file_offsets
-                   )
-
-    if pool_label_file is not None:
-        pool_labels = get_labels(pool_label_file)
-        dataset['pool_labels'] = pool_labels
+                   key=key)
+    dataset.update(matrices)
+    dataset.update(arrays)
 
     return dataset
 
 
 if __name__ == '__main__':
     data_dir = './data/example/'
-    model = LeastConfidenceALModel(dataset_func=lambda: get_dataset(data_dir),
+    model = LeastConfidenceALModel(dataset_func=lambda: get_dataset(data_dir, cache_dir='./models/cache'),
                                    output_dir='./models/',
                                    project_name='project1',
                                    name='model1',
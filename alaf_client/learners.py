@@ -0,0 +1,120 @@
+from sklearn.svm import SVC
+from sklearn.linear_model import SGDClassifier, LogisticRegression
+from scipy.sparse import issparse
+import numpy as np
+
+from selection import margin_confidence
+
+
+class Learner(object):
+
+    # True if update only needs the new instances instead of all training data
+    incremental = False
+
+    def __init__(self):
+        """
+        Learner backend of the SVM based example models. Wraps a sklearn classifier and
+        provides a confidence score for the least confidence selection.
+        """
+        self.ml_model = None
+
+    def fit(self, x, y):
+        """
+        Train from scratch.
+        :param x: feature matrix
+        :param y: labels
+        :return: self
+        """
+        self.ml_model.fit(x, y)
+        return self
+
+    def update(self, x, y, x_new, y_new):
+        """
+        Train after new instances were added. Retrains with all training data if not incremental.
+        :param x: all training features including the new ones (None for incremental learners)
+        :param y: all training labels including the new ones (None for incremental learners)
+        :param x_new: features of the new instances
+        :param y_new: labels of the new instances
+        :return: self
+        """
+        return self.fit(x, y)
+
+    def predict(self, x):
+        return self.ml_model.predict(x)
+
+    def confidence(self, x):
+        """
+        Confidence of the prediction for each row, higher is more confident.
+        :param x: feature matrix
+        :return: numpy array
+        """
+        return margin_confidence(self.ml_model.decision_function(x))
+
+    def weights(self):
+        """
+        Weights of the linear model, enough to score instances without the sklearn model.
+        decision function = x * coef.T + intercept
+        :return: coef (classes x features), intercept
+        """
+        coef = self.ml_model.coef_
+        if issparse(coef):
+            coef = coef.toarray()
+        return np.asarray(coef, dtype=np.float64), np.asarray(self.ml_model.intercept_, dtype=np.float64)
+
+
+class SvcLearner(Learner):
+
+    def __init__(self):
+        """
+        Linear SVM retrained from scratch after every update. Confidence is the decision function
+        margin, selection scores the pool with the weights, calibrated probabilities would not be used.
+        """
+        super(SvcLearner, self).__init__()
+        self.ml_model = SVC(kernel='linear')
+
+
+class SgdLearner(Learner):
+
+    incremental = True
+
+    def __init__(self):
+        """
+        Online linear classifier. Trained on the initial training data and afterwards only updated
+        with partial_fit on the new instances.
+        """
+        super(SgdLearner, self).__init__()
+        self.ml_model = SGDClassifier(loss='modified_huber', max_iter=20, tol=None)
+
+    def update(self, x, y, x_new, y_new):
+        # partial_fit only accepts the classes of the initial training data, skipped instances are not trained on
+        self.ml_model.partial_fit(x_new, y_new, classes=self.ml_model.classes_)
+        return self
+
+
+class LogisticLearner(Learner):
+
+    def __init__(self):
+        """
+        Logistic regression retrained with all training data, warm started from the
+        previous weights so only few solver iterations are needed per update.
+        """
+        super(LogisticLearner, self).__init__()
+        self.ml_model = LogisticRegression(solver='lbfgs', warm_start=True, max_iter=100)
+
+
+learners = {'svc': SvcLearner,
+            # same as svc since svc is not calibrated any more, kept for existing command lines
+            'svc_margin': SvcLearner,
+            'sgd': SgdLearner,
+            'logistic': LogisticLearner}
+
+
+def get_learner(name):
+    """
+    Instantiate a learner backend.
+    :param name: svc, svc_margin, sgd or logistic
+    :return: Learner
+    """
+    if name not in learners:
+        raise ValueError('unknown learner: {}. Use one of {}'.format(name, ', '.join(learners)))
+    return learners[name]()
@@ -0,0 +1,424 @@
+from scipy.sparse import csr_matrix
+import numpy as np
+from hashlib import blake2b
+import hashlib
+import json
+import mmap
+import os
+
+from dataset_cache import temporary_path
+
+data_dtype = np.float32
+indices_dtype = np.int32
+indptr_dtype = np.int64
+
+# pool matrix and selected rows of a selection worker process, set by init_worker
+_worker = dict()
+
+
+def line_hash(utterance):
+    """
+    64 bit hash of an utterance (stripped pool line).
+    :param utterance: text
+    :return: int
+    """
+    return int.from_bytes(blake2b(utterance.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def file_key(pool_file):
+    """
+    Identity of the pool file. Changes if the file is replaced or modified.
+    :param pool_file: path to pool file
+    :return: hex digest
+    """
+    stat = os.stat(pool_file)
+    key = '{}:{}:{}'.format(os.path.abspath(pool_file), stat.st_size, stat.st_mtime_ns)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+def pool_key(pool_file, vectorizer):
+    """
+    Cache key of a vectorized pool. Changes if the pool file or the vocabulary changes.
+    :param pool_file: path to pool file
+    :param vectorizer: fitted CountVectorizer
+    :return: hex digest
+    """
+    h = hashlib.sha1()
+    h.update(file_key(pool_file).encode('utf-8'))
+    for term, index in sorted(vectorizer.vocabulary_.items()):
+        h.update('{}:{}\n'.format(term, index).encode('utf-8'))
+    return h.hexdigest()
+
+
+def write_pool_matrix(chunks, n_features, directory):
+    """
+    Write sparse row chunks as one CSR matrix to data/indices/indptr files. Only one chunk is in memory
+    at a time. Files are written under temporary names and moved in place when complete, meta.json last.
+    Several processes may write the same matrix at once, the files have the same content.
+    :param chunks: iterable of sparse matrices with n_features columns
+    :param n_features: number of columns
+    :param directory: output folder
+    """
+    os.makedirs(directory, exist_ok=True)
+    paths = {name: os.path.join(directory, name + '.bin') for name in ('data', 'indices', 'indptr')}
+    tmp = {name: temporary_path(path) for name, path in paths.items()}
+
+    n_rows = 0
+    nnz = 0
+    with open(tmp['data'], 'wb') as f_data, open(tmp['indices'], 'wb') as f_indices, \
+            open(tmp['indptr'], 'wb') as f_indptr:
+        np.zeros(1, dtype=indptr_dtype).tofile(f_indptr)
+        for x in chunks:
+            x = csr_matrix(x)
+            x.data.astype(data_dtype).tofile(f_data)
+            x.indices.astype(indices_dtype).tofile(f_indices)
+            (x.indptr[1:] + nnz).astype(indptr_dtype).tofile(f_indptr)
+            n_rows, nnz = n_rows + x.shape[0], nnz + x.nnz
+
+    for name in paths:
+        os.replace(tmp[name], paths[name])
+    meta = {'shape': [n_rows, n_features], 'nnz': nnz}
+    meta_file = os.path.join(directory, 'meta.json')
+    with open(temporary_path(meta_file), 'w') as f:
+        json.dump(meta, f)
+    os.replace(temporary_path(meta_file), meta_file)
+
+
+def build_pool_matrix(pool_file, vectorizer, directory, chunk_lines=100000):
+    """
+    Vectorize the pool file once and write it as CSR matrix. The pool is streamed in chunks,
+    it never has to fit into memory completely.
+    :param pool_file: path to pool file, one utterance per line
+    :param vectorizer: fitted CountVectorizer
+    :param directory: output folder
+    :param chunk_lines: lines vectorized at once
+    """
+    def chunks():
+        lines = list()
+        # read binary like the line offsets, text mode would also split on '\r'
+        with open(pool_file, 'rb') as f_pool:
+            for line in f_pool:
+                lines.append(line.decode('utf-8'))
+                if len(lines) == chunk_lines:
+                    yield vectorizer.transform(lines)
+                    lines = list()
+        if lines:
+            yield vectorizer.transform(lines)
+
+    write_pool_matrix(chunks(), len(vectorizer.vocabulary_), directory)
+
+
+def get_pool_matrix(pool_file, vectorizer, cache_dir, key=None, build=True):
+    """
+    Folder of the vectorized pool in the cache. Builds it if it does not exist yet.
+    :param pool_file: path to pool file
+    :param vectorizer: fitted CountVectorizer
+    :param cache_dir: cache folder
+    :param key: key of the dataset if it comes from the dataset cache, saves hashing the vocabulary
+    :param build: False to return None instead of building a missing pool matrix
+    :return: folder for PoolMatrix
+    """
+    directory = os.path.join(cache_dir, 'pool_' + (key or pool_key(pool_file, vectorizer)))
+    if not os.path.exists(os.path.join(directory, 'meta.json')):
+        if not build:
+            return None
+        print('vectorize pool into: {}'.format(directory))
+        build_pool_matrix(pool_file, vectorizer, directory)
+    return directory
+
+
+class PoolMatrix(object):
+
+    def __init__(self, directory):
+        """
+        Read-only memory mapped CSR matrix of the vectorized pool. Processes opening the same
+        files share the pages through the OS page cache.
+        :param directory: folder written by write_pool_matrix
+        """
+        with open(os.path.join(directory, 'meta.json')) as f:
+            meta = json.load(f)
+        self.shape = tuple(meta['shape'])
+
+        def open_file(name, dtype, size):
+            if size == 0:
+                return np.zeros(0, dtype=dtype)
+            return np.memmap(os.path.join(directory, name + '.bin'), dtype=dtype, mode='r', shape=(size,))
+
+        self.data = open_file('data', data_dtype, meta['nnz'])
+        self.indices = open_file('indices', indices_dtype, meta['nnz'])
+        self.indptr = open_file('indptr', indptr_dtype, self.shape[0] + 1)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def rows(self, start, end):
+        """
+        Rows start to end (exclusive) as sparse matrix backed by the memory mapped files.
+        :param start: first row
+        :param end: row after the last row
+        :return: csr_matrix
+        """
+        indptr = np.asarray(self.indptr[start:end + 1])
+        first, last = indptr[0], indptr[-1]
+        return csr_matrix((self.data[first:last], self.indices[first:last], indptr - first),
+                          shape=(end - start, self.shape[1]), copy=False)
+
+    def take(self, rows):
+        """
+        Arbitrary rows in the given order, copied into memory.
+        :param rows: row indices
+        :return: csr_matrix
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        starts, ends = np.asarray(self.indptr[rows]), np.asarray(self.indptr[rows + 1])
+        lengths = ends - starts
+        indptr = np.zeros(len(rows) + 1, dtype=indptr_dtype)
+        np.cumsum(lengths, out=indptr[1:])
+        # position of every value in the memory mapped files
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return csr_matrix((self.data[positions], self.indices[positions], indptr),
+                          shape=(len(rows), self.shape[1]))
+
+
+def build_pool_index(pool_file, directory):
+    """
+    Hash every pool line and write the hashes sorted together with their row index.
+    :param pool_file: path to pool file, one utterance per line
+    :param directory: output folder
+    """
+    os.makedirs(directory, exist_ok=True)
+    with open(pool_file, 'rb') as f:
+        hashes = np.fromiter((line_hash(line.decode('utf-8').rstrip()) for line in f), dtype=np.uint64)
+    rows = np.argsort(hashes, kind='stable')
+    for name, array in (('hashes', hashes[rows]), ('rows', rows.astype(np.int64))):
+        path = os.path.join(directory, name + '.npy')
+        with open(temporary_path(path), 'wb') as f:
+            np.save(f, array)
+        os.replace(temporary_path(path), path)
+
+
+def get_pool_index(pool_file, cache_dir):
+    """
+    Index from line hash to pool rows from the cache. Builds it if it does not exist yet.
+    :param pool_file: path to pool file
+    :param cache_dir: cache folder
+    :return: PoolIndex
+    """
+    directory = os.path.join(cache_dir, 'index_' + file_key(pool_file))
+    if not os.path.exists(os.path.join(directory, 'rows.npy')):
+        print('index pool into: {}'.format(directory))
+        build_pool_index(pool_file, directory)
+    return PoolIndex(directory)
+
+
+class PoolIndex(object):
+
+    def __init__(self, directory):
+        """
+        Sorted line hashes of the pool with their rows, memory mapped. Lookups are a binary search.
+        Text is not compared, with 64 bit hashes collisions are negligible even for 10^7 lines.
+        :param directory: folder written by build_pool_index
+        """
+        self.hashes = np.load(os.path.join(directory, 'hashes.npy'), mmap_mode='r')
+        self.rows = np.load(os.path.join(directory, 'rows.npy'), mmap_mode='r')
+
+    def __len__(self):
+        return len(self.rows)
+
+    def rows_of(self, utterance):
+        """
+        All rows of the pool with this utterance.
+        :param utterance: text
+        :return: numpy array of row indices, empty if not in the pool
+        """
+        h = np.uint64(line_hash(utterance))
+        start = np.searchsorted(self.hashes, h, side='left')
+        end = np.searchsorted(self.hashes, h, side='right')
+        return np.asarray(self.rows[start:end])
+
+
+class SelectedRows(object):
+
+    def __init__(self, path, n_rows, mode='r+'):
+        """
+        Bitmask with one bit per pool row, memory mapped from a file. Processes mapping the same
+        file see changes without any messages. The file is created if it does not exist.
+        :param path: file of the bitmask
+        :param n_rows: number of pool rows
+        :param mode: r+ to change the bitmask, r for read only access
+        """
+        self.n_rows = n_rows
+        n_bytes = max((n_rows + 7) // 8, 1)
+        if not os.path.exists(path) or os.path.getsize(path) != n_bytes:
+            with open(path, 'wb') as f:
+                f.truncate(n_bytes)
+        self.path = path
+        self.bits = np.memmap(path, dtype=np.uint8, mode=mode, shape=(n_bytes,))
+
+    def __contains__(self, row):
+        return bool(self.bits[row >> 3] & (128 >> (row & 7)))
+
+    def __getitem__(self, rows):
+        """
+        Selected flags of a range of rows.
+        :param rows: slice with start and stop
+        :return: numpy array of 0 and 1, one entry per row
+        """
+        start, stop = rows.start or 0, self.n_rows if rows.stop is None else rows.stop
+        unpacked = np.unpackbits(self.bits[start >> 3:(stop + 7) >> 3])
+        return unpacked[start & 7:(start & 7) + stop - start]
+
+    def __len__(self):
+        """
+        :return: number of selected rows
+        """
+        return int(np.unpackbits(self.bits)[:self.n_rows].sum())
+
+    def add(self, rows):
+        """
+        Mark rows as selected.
+        :param rows: row index or iterable of row indices
+        """
+        rows = np.atleast_1d(np.asarray(rows, dtype=np.int64))
+        np.bitwise_or.at(self.bits, rows >> 3, (128 >> (rows & 7)).astype(np.uint8))
+
+    def clear(self):
+        self.bits[:] = 0
+
+    def flush(self):
+        self.bits.flush()
+
+
+def line_offsets(path, block_size=1 << 24):
+    """
+    Byte offset of every line of a file. Newlines are searched with numpy in blocks.
+    :param path: file
+    :param block_size: bytes read at once
+    :return: int64 numpy array
+    """
+    offsets = [np.zeros(1, dtype=np.int64)]
+    position = 0
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == ord('\n'))
+            offsets.append(newlines.astype(np.int64) + position + 1)
+            position += len(block)
+    offsets = np.concatenate(offsets)
+    # no line starts at the end of the file
+    if offsets[-1] == position:
+        offsets = offsets[:-1]
+    return offsets
+
+
+class PoolText(object):
+
+    def __init__(self, pool_file, offsets):
+        """
+        Read access to pool lines through one memory map of the pool file, kept open for the
+        lifetime of the model.
+        :param pool_file: path to pool file
+        :param offsets: byte offset of every line, int64 numpy array
+        """
+        self.offsets = offsets
+        self._file = open(pool_file, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(offsets) else None
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def line(self, row):
+        """
+        :param row: line index
+        :return: utterance without line break
+        """
+        start = int(self.offsets[row])
+        end = self._mmap.find(b'\n', start)
+        if end == -1:
+            end = len(self._mmap)
+        return self._mmap[start:end].decode('utf-8').rstrip()
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+        self._file.close()
+
+
+class PermutationSampler(object):
+
+    def __init__(self, directory, n_rows, seed):
+        """
+        Draws pool rows without replacement in the order of a seeded random permutation. The permutation
+        is stored as npy file and memory mapped. The position in it is saved with save, a restarted model
+        continues where it stopped.
+        :param directory: folder for the permutation and position files, e.g. the model folder
+        :param n_rows: number of pool rows
+        :param seed: seed of the permutation
+        """
+        self.n_rows = n_rows
+        self.seed = seed
+        self.permutation_file = os.path.join(directory, 'permutation_{}_{}.npy'.format(seed, n_rows))
+        self.state_file = os.path.join(directory, 'sampler.json')
+
+        if not os.path.exists(self.permutation_file):
+            permutation = np.random.RandomState(seed).permutation(n_rows).astype(np.int64)
+            with open(self.permutation_file + '.tmp', 'wb') as f:
+                np.save(f, permutation)
+            os.replace(self.permutation_file + '.tmp', self.permutation_file)
+        self.permutation = np.load(self.permutation_file, mmap_mode='r')
+
+        self.position = 0
+        if os.path.exists(self.state_file):
+            with open(self.state_file) as f:
+                state = json.load(f)
+            if state.get('seed') == seed and state.get('n_rows') == n_rows:
+                self.position = state['position']
+
+    def next(self, selected=None):
+        """
+        Next row of the permutation. Rows which have been selected otherwise are skipped,
+        every position is visited once so this is O(1) amortized.
+        :param selected: SelectedRows or None
+        :return: row index or None if the pool is exhausted
+        """
+        row = None
+        while self.position < self.n_rows:
+            candidate = int(self.permutation[self.position])
+            self.position += 1
+            if selected is None or candidate not in selected:
+                row = candidate
+                break
+        return row
+
+    def save(self):
+        """
+        Write the position to disk.
+        """
+        with open(self.state_file + '.tmp', 'w') as f:
+            json.dump({'seed': self.seed, 'n_rows': self.n_rows, 'position': self.position}, f)
+        os.replace(self.state_file + '.tmp', self.state_file)
+
+
+def init_worker(directory, selected_path, n_rows):
+    """
+    Initializer of the selection worker processes. Opens the pool matrix and the selected rows
+    once per process.
+    :param directory: folder of the pool matrix
+    :param selected_path: file of the selected rows bitmask
+    :param n_rows: number of pool rows
+    """
+    _worker['matrix'] = PoolMatrix(directory)
+    _worker['selected'] = SelectedRows(selected_path, n_rows, mode='r')
+
+
+def worker_matrix():
+    """
+    :return: pool matrix of this worker process
+    """
+    return _worker['matrix']
+
+
+def worker_selected():
+    """
+    :return: selected rows of this worker process
+    """
+    return _worker['selected']
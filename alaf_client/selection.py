@@ -0,0 +1,71 @@
+import numpy as np
+
+
+def margin_confidence(scores):
+    """
+    Confidence from decision function values, higher is more confident. Distance to the decision
+    boundary ranks instances like calibrated probabilities of a linear model.
+    :param scores: decision function values, one column per class or 1d for binary
+    :return: numpy array
+    """
+    if scores.ndim == 1 or scores.shape[1] == 1:
+        return np.abs(np.ravel(scores))
+    # multi class: margin between the best and the second best class
+    scores = np.sort(scores, axis=1)
+    return scores[:, -1] - scores[:, -2]
+
+
+def margin_scores(x, coef, intercept):
+    """
+    Margin confidence of a linear model, one sparse matrix product for all rows.
+    :param x: sparse feature matrix
+    :param coef: weights, classes x features
+    :param intercept: bias per class
+    :return: numpy array
+    """
+    return margin_confidence(np.asarray(x.dot(coef.T)) + intercept)
+
+
+def masked_top_k(values, mask, k):
+    """
+    Indices of the k smallest values which are not masked, smallest first. Linear in the number of
+    values, only the k selected values are sorted.
+    :param values: numpy array
+    :param mask: numpy array, non zero for excluded entries
+    :param k: number of indices
+    :return: numpy array of indices, shorter than k if not enough entries are left
+    """
+    values = np.where(mask != 0, np.inf, values)
+    k = min(k, len(values))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    if k == 1:
+        idx = np.array([np.argmin(values)])
+    else:
+        idx = np.argpartition(values, k - 1)[:k]
+        idx = idx[np.argsort(values[idx], kind='stable')]
+    return idx[np.isfinite(values[idx])]
+
+
+def least_confident(matrix, coef, intercept, start, end, mask, k, block_size=None):
+    """
+    The k least confident rows of a slice of the pool matrix which are not masked.
+    Rows are scored in blocks of block_size to bound the memory of the intermediate product.
+    :param matrix: PoolMatrix or sparse matrix with rows(start, end)
+    :param coef: weights, classes x features
+    :param intercept: bias per class
+    :param start: first row
+    :param end: row after the last row
+    :param mask: numpy array or SelectedRows over all rows, non zero for rows which must not be selected
+    :param k: number of rows
+    :param block_size: rows scored at once, default all
+    :return: row indices, confidence scores
+    """
+    block_size = block_size or max(end - start, 1)
+    confs = np.empty(end - start)
+    for block_start in range(start, end, block_size):
+        block_end = min(block_start + block_size, end)
+        confs[block_start - start:block_end - start] = margin_scores(matrix.rows(block_start, block_end),
+                                                                     coef, intercept)
+    idx = masked_top_k(confs, mask[start:end], k)
+    return idx + start, confs[idx]
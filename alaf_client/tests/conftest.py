@@ -0,0 +1,6 @@
+import os
+import sys
+
+# the example modules are imported by name from alaf_client, like example.py does. Appended, so
+# cmd.py of the client does not hide the cmd module of the standard library which pytest needs
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from annotation_log import AnnotationLog, encode, magic
+
+
+def test_records_survive_reopen(tmp_path):
+    path = str(tmp_path / 'annotations.log')
+    log = AnnotationLog(path)
+    log.append([(3, 1, None), (-1, 0, 'not in the pool'), (7, 1, None)])
+    log.close()
+
+    log = AnnotationLog(path)
+    assert [(r.row, r.label, r.count, r.text) for r in log.records] == \
+        [(3, 1, 1, None), (-1, 0, 2, 'not in the pool'), (7, 1, 3, None)]
+    log.close()
+
+
+@pytest.mark.parametrize('cut', [1, 10, 30])
+def test_partly_written_record_is_cut_off(tmp_path, cut):
+    path = str(tmp_path / 'annotations.log')
+    log = AnnotationLog(path)
+    log.append([(3, 1, None), (4, 0, 'text')])
+    log.close()
+    complete = os.path.getsize(path)
+
+    # crash in the middle of the third record
+    record = encode(5, 1, 3, 0.0, 'lost')
+    with open(path, 'ab') as f:
+        f.write(record[:cut])
+
+    log = AnnotationLog(path)
+    assert len(log) == 2
+    assert os.path.getsize(path) == complete
+    # appending continues after the last complete record
+    log.append([(6, 0, None)])
+    log.close()
+
+    log = AnnotationLog(path)
+    assert [(r.row, r.count) for r in log.records] == [(3, 1), (4, 2), (6, 3)]
+    log.close()
+
+
+def test_corrupt_record_drops_the_rest(tmp_path):
+    path = str(tmp_path / 'annotations.log')
+    log = AnnotationLog(path)
+    log.append([(1, 1, None), (2, 0, None), (3, 1, None)])
+    log.close()
+
+    # flip a byte in the header of the second record, its checksum no longer matches
+    second = len(magic) + len(encode(1, 1, 1, 0.0))
+    with open(path, 'r+b') as f:
+        f.seek(second)
+        byte = f.read(1)
+        f.seek(second)
+        f.write(bytes([byte[0] ^ 0xff]))
+
+    log = AnnotationLog(path)
+    assert [r.row for r in log.records] == [1]
+    assert os.path.getsize(path) == second
+    log.close()
+
+
+def test_not_a_log(tmp_path):
+    path = str(tmp_path / 'annotations.log')
+    with open(path, 'wb') as f:
+        f.write(b'something else')
+    with pytest.raises(ValueError):
+        AnnotationLog(path)
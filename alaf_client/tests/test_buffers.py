@@ -0,0 +1,49 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from buffers import SparseRowBuffer
+
+
+def test_growth_keeps_earlier_views():
+    n_features = 20
+    matrix = sparse_random(50, n_features, density=0.3, format='csr', random_state=0)
+    labels = np.arange(50) % 2
+    buffer = SparseRowBuffer(n_features, capacity=2, nnz_capacity=4)
+
+    buffer.append(matrix[:3], labels[:3])
+    rows, y = buffer.rows(), buffer.labels()
+    tail = buffer.rows(1)
+    expected_rows, expected_tail = rows.toarray(), tail.toarray()
+    data = buffer.data
+
+    # one by one, so rows, data and labels have to grow several times
+    for i in range(3, 50):
+        buffer.append(matrix[i], labels[i:i + 1])
+    assert buffer.data is not data
+
+    np.testing.assert_array_equal(rows.toarray(), expected_rows)
+    np.testing.assert_array_equal(tail.toarray(), expected_tail)
+    np.testing.assert_array_equal(y, labels[:3])
+
+    assert len(buffer) == 50
+    np.testing.assert_array_equal(buffer.rows().toarray(), matrix.toarray())
+    np.testing.assert_array_equal(buffer.rows(10, 20).toarray(), matrix[10:20].toarray())
+    np.testing.assert_array_equal(buffer.labels(10, 20), labels[10:20])
+
+
+def test_empty_rows():
+    buffer = SparseRowBuffer(5, capacity=1)
+    buffer.append(np.zeros((3, 5)), [0, 1, 0])
+    buffer.append(np.eye(5)[:1], [1])
+    assert buffer.nnz == 1
+    np.testing.assert_array_equal(buffer.rows(3).toarray(), np.eye(5)[:1])
+    assert buffer.rows(2, 100).shape == (2, 5)
+
+
+def test_wrong_shapes():
+    buffer = SparseRowBuffer(5)
+    with pytest.raises(ValueError):
+        buffer.append(np.zeros((2, 4)), [0, 1])
+    with pytest.raises(ValueError):
+        buffer.append(np.zeros((2, 5)), [0])
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+from pool import PermutationSampler, SelectedRows
+
+
+@pytest.mark.parametrize('start,stop', [(0, 21), (3, 5), (3, 13), (5, 8), (7, 9), (9, 21), (13, 13), (0, 1)])
+def test_selected_rows_ranges(tmp_path, start, stop):
+    n_rows = 21
+    chosen = [0, 2, 3, 7, 8, 9, 12, 15, 16, 20]
+    selected = SelectedRows(str(tmp_path / 'selected'), n_rows)
+    selected.add(chosen)
+
+    expected = np.zeros(n_rows, dtype=np.uint8)
+    expected[chosen] = 1
+    np.testing.assert_array_equal(selected[start:stop], expected[start:stop])
+    assert len(selected) == len(chosen)
+    assert all(row in selected for row in chosen)
+    assert 1 not in selected
+
+
+def test_selected_rows_shared(tmp_path):
+    path = str(tmp_path / 'selected')
+    writer = SelectedRows(path, 30)
+    reader = SelectedRows(path, 30, mode='r')
+    writer.add(17)
+    assert 17 in reader
+    np.testing.assert_array_equal(reader[:], np.eye(30, dtype=np.uint8)[17])
+
+
+def test_permutation_resumes_after_save(tmp_path):
+    directory = str(tmp_path)
+    sampler = PermutationSampler(directory, 50, seed=3)
+    first = [sampler.next() for _ in range(10)]
+    sampler.save()
+    # drawn after the save, a restarted model draws these again
+    unsaved = [sampler.next() for _ in range(5)]
+
+    sampler = PermutationSampler(directory, 50, seed=3)
+    rest = [sampler.next() for _ in range(40)]
+    assert rest[:5] == unsaved
+    assert sorted(first + rest) == list(range(50))
+    assert sampler.next() is None
+
+
+def test_permutation_skips_selected(tmp_path):
+    selected = SelectedRows(str(tmp_path / 'selected'), 20)
+    sampler = PermutationSampler(str(tmp_path), 20, seed=0)
+    selected.add([int(row) for row in sampler.permutation[:20:2]])
+    rows = [sampler.next(selected) for _ in range(10)]
+    assert rows == [int(row) for row in sampler.permutation[1:20:2]]
+    assert sampler.next(selected) is None
+
+
+def test_permutation_of_other_seed_starts_again(tmp_path):
+    sampler = PermutationSampler(str(tmp_path), 20, seed=0)
+    sampler.next()
+    sampler.save()
+    assert PermutationSampler(str(tmp_path), 20, seed=1).position == 0
+    assert PermutationSampler(str(tmp_path), 21, seed=0).position == 0
+    assert PermutationSampler(str(tmp_path), 20, seed=0).position == 1
@@ -0,0 +1,33 @@
+import numpy as np
+
+from selection import masked_top_k
+
+
+def test_masked_rows_are_skipped():
+    values = np.array([0.5, 0.1, 0.3, 0.2, 0.4])
+    mask = np.array([0, 1, 0, 1, 0], dtype=np.uint8)
+    np.testing.assert_array_equal(masked_top_k(values, mask, 2), [2, 4])
+    np.testing.assert_array_equal(masked_top_k(values, mask, 1), [2])
+
+
+def test_k_larger_than_remaining():
+    values = np.array([0.5, 0.1, 0.3, 0.2, 0.4])
+    mask = np.array([1, 0, 1, 0, 1], dtype=np.uint8)
+    np.testing.assert_array_equal(masked_top_k(values, mask, 4), [1, 3])
+    np.testing.assert_array_equal(masked_top_k(values, mask, 10), [1, 3])
+
+
+def test_all_masked_or_empty():
+    values = np.array([0.5, 0.1])
+    assert len(masked_top_k(values, np.ones(2, dtype=np.uint8), 1)) == 0
+    assert len(masked_top_k(values, np.ones(2, dtype=np.uint8), 3)) == 0
+    assert len(masked_top_k(np.zeros(0), np.zeros(0, dtype=np.uint8), 3)) == 0
+    assert len(masked_top_k(values, np.zeros(2, dtype=np.uint8), 0)) == 0
+
+
+def test_matches_full_sort():
+    rng = np.random.RandomState(0)
+    values = rng.rand(1000)
+    mask = (rng.rand(1000) < 0.3).astype(np.uint8)
+    order = [i for i in np.argsort(values, kind='stable') if not mask[i]]
+    np.testing.assert_array_equal(masked_top_k(values, mask, 25), order[:25])
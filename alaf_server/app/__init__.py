@@ -2,10 +2,12 @@ from flask import Flask
 from flask_bootstrap import Bootstrap
 from flask_sqlalchemy import SQLAlchemy
 from flask_socketio import SocketIO
+from . import database
 
 app = Flask(__name__)
 bootstrap = Bootstrap(app)
 app.config.from_pyfile('../config.py')
+database.configure(app)
 db = SQLAlchemy(app)
 
 async_mode = None  # "threading"
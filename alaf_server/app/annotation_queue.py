@@ -0,0 +1,111 @@
+from . import app, db, write_behind
+from .models import Instance, Model
+
+import time
+from random import shuffle
+
+# maximal difference in annotated instances (count) between the model with
+# the lowest and the model with the highest count
+max_count_diff = 500
+
+
+def not_leased(now, lease):
+    """
+    Filter for instances which are not shown to an annotator at the moment: never shown,
+    or shown more than lease seconds ago without being annotated.
+    :param now: timestamp
+    :param lease: seconds
+    :return: sqlalchemy filter expression
+    """
+    return db.or_(Instance.show_time.is_(None), Instance.show_time < now - lease)
+
+
+def pending_instance(model_id, lease=None):
+    """
+    Oldest unannotated instance of one model. Served by the (model_id, annotation) index,
+    only the pending instances of the model are filtered by show time.
+    :param model_id:
+    :param lease: skip instances shown to an annotator less than lease seconds ago, None to include them
+    :return: Instance or None
+    """
+    query = Instance.query.filter(db.and_(Instance.model_id == model_id,
+                                          Instance.annotation.is_(None)))
+    if lease is not None:
+        query = query.filter(not_leased(time.time(), lease))
+    return query.order_by(Instance.id).first()
+
+
+def claim(instance, lease):
+    """
+    Tag an instance with its show time, unless another annotator got it in the meantime.
+    A single conditional UPDATE, so two annotators never claim the same instance.
+    :param instance: Instance
+    :param lease: seconds, see pending_instance
+    :return: True if claimed
+    """
+    now = time.time()
+    claimed = Instance.query.filter(db.and_(Instance.id == instance.id,
+                                            Instance.annotation.is_(None),
+                                            not_leased(now, lease)))\
+        .update({'show_time': now}, synchronize_session=False)
+    db.session.commit()
+    return claimed == 1
+
+
+def release(instance_id):
+    """
+    Make an instance which was shown but not annotated available to other annotators again,
+    e.g. when its annotator left.
+    :param instance_id:
+    """
+    Instance.query.filter(db.and_(Instance.id == instance_id,
+                                  Instance.annotation.is_(None)))\
+        .update({'show_time': None}, synchronize_session=False)
+    db.session.commit()
+
+
+def has_pending_instance(project_id):
+    """
+    Check if any instance of the project waits for an annotation.
+    Served by the (project_id, annotation) index.
+    :param project_id:
+    :return: bool
+    """
+    query = Instance.query.filter(db.and_(Instance.project_id == project_id,
+                                          Instance.annotation.is_(None)))
+    return db.session.query(query.exists()).scalar()
+
+
+def next_instance(project_id):
+    """
+    Select the next unannotated instance of a project. Models are visited in random order and
+    each model is probed with a single indexed query for its oldest pending instance. If the counts
+    of the models differ by more than max_count_diff, models which are max_count_diff or more instances
+    ahead of the slowest model are skipped.
+    The selected instance is tagged with its show time and not handed out again for ANNOTATION_LEASE
+    seconds, so annotators working on the same project get different instances.
+    :param project_id:
+    :return: Instance or None if no instance is left
+    """
+    write_behind.flush()
+    lease = app.config.get('ANNOTATION_LEASE', 300)
+    models = Model.query.with_entities(Model.id, Model.count).filter_by(project_id=project_id).all()
+    counts = [count or 0 for _, count in models]
+    min_count = min(counts) if counts else 0
+    max_count = max(counts) if counts else 0
+
+    model_ids = [model_id for model_id, count in models
+                 if max_count - min_count <= max_count_diff or (count or 0) - min_count < max_count_diff]
+    shuffle(model_ids)
+
+    for model_id in model_ids:
+        instance = pending_instance(model_id, lease)
+        while instance is not None:
+            if claim(instance, lease):
+                db.session.refresh(instance)
+                return instance
+            instance = pending_instance(model_id, lease)
+
+    if len(model_ids) < len(models) and has_pending_instance(project_id):
+        raise AttributeError('Count difference higher than {}'.format(max_count_diff))
+    return None
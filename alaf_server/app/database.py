@@ -0,0 +1,96 @@
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.schema import CreateIndex
+import sqlite3
+
+# pragmas of the selected profile, applied to every new sqlite connection
+_sqlite_pragmas = dict()
+
+
+def get_profile(config):
+    """
+    Database profile selected by DATABASE_PROFILE.
+    :param config: app config or dict
+    :return: profile dict with uri and engine settings
+    """
+    name = config['DATABASE_PROFILE']
+    if name not in config['DATABASE_PROFILES']:
+        raise ValueError('unknown database profile: {}'.format(name))
+    return config['DATABASE_PROFILES'][name]
+
+
+def engine_options(profile):
+    """
+    Keyword arguments for sqlalchemy.create_engine from a profile.
+    :param profile: profile dict
+    :return: dict
+    """
+    return {k: profile[k] for k in ('pool_size', 'max_overflow', 'pool_recycle') if k in profile}
+
+
+def configure(app):
+    """
+    Set database uri and pool settings of the selected profile. Call before SQLAlchemy(app).
+    :param app: flask app
+    """
+    profile = get_profile(app.config)
+    app.config['SQLALCHEMY_DATABASE_URI'] = profile['uri']
+    for key, value in engine_options(profile).items():
+        app.config['SQLALCHEMY_' + key.upper()] = value
+    _sqlite_pragmas.clear()
+    _sqlite_pragmas.update(profile.get('pragmas', {}))
+
+
+def apply_pragmas(dbapi_connection, pragmas):
+    """
+    Execute pragmas on a raw sqlite connection.
+    :param dbapi_connection: sqlite3 connection
+    :param pragmas: dict pragma -> value
+    """
+    cursor = dbapi_connection.cursor()
+    for pragma, value in pragmas.items():
+        cursor.execute('PRAGMA {}={}'.format(pragma, value))
+    cursor.close()
+
+
+@event.listens_for(Engine, 'connect')
+def _on_connect(dbapi_connection, connection_record):
+    """
+    Apply the pragmas of the selected profile to new sqlite connections.
+    """
+    if _sqlite_pragmas and isinstance(dbapi_connection, sqlite3.Connection):
+        apply_pragmas(dbapi_connection, _sqlite_pragmas)
+
+
+def upgrade_schema(engine, metadata):
+    """
+    Create missing tables, add missing columns and indexes to tables of an existing database.
+    Indexes created by index=True of older versions (ix_ prefix) which are no longer declared are dropped.
+    Works for sqlite and postgresql. Added columns are nullable and existing constraints are not changed.
+    :param engine: sqlalchemy engine
+    :param metadata: metadata of the models
+    """
+    metadata.create_all(engine)
+    inspector = inspect(engine)
+
+    for table in metadata.sorted_tables:
+        columns = set(c['name'] for c in inspector.get_columns(table.name))
+        for column in table.columns:
+            if column.name in columns:
+                continue
+            column_type = column.type.compile(dialect=engine.dialect)
+            engine.execute('ALTER TABLE {} ADD COLUMN {} {}'.format(table.name, column.name, column_type))
+            print('added column {}.{}'.format(table.name, column.name))
+
+        indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        for index in table.indexes:
+            if index.name not in indexes:
+                engine.execute(CreateIndex(index))
+                print('created index {}'.format(index.name))
+
+        declared = set(index.name for index in table.indexes)
+        for name in indexes - declared:
+            if name.startswith('ix_'):
+                # not via Index(name, _table=table), that would add the index to the table of the models
+                engine.execute('DROP INDEX {}'.format(name))
+                print('dropped index {}'.format(name))
@@ -3,8 +3,8 @@ from .plots import colors
 
 from flask import flash
 from flask_wtf import FlaskForm
-from wtforms import HiddenField, StringField, SubmitField, IntegerField, FieldList, FormField
-from wtforms.validators import ValidationError, DataRequired, Regexp, Length
+from wtforms import HiddenField, StringField, SubmitField, IntegerField, BooleanField, FieldList, FormField
+from wtforms.validators import ValidationError, DataRequired, Regexp, Length, NumberRange
 
 
 def get_letter_validator():
@@ -79,6 +79,8 @@ class EditProjectForm(FlaskForm):
                                                    length_val(4, 75)])
     id = HiddenField()
     max_count = IntegerField('Number of Instances', default=500)
+    batch_size = IntegerField('Utterances per Round', default=1, validators=[NumberRange(min=1)])
+    reuse_annotations = BooleanField('Reuse Annotations of other Models', default=False)
     models = FieldList(FormField(ModelForm),
                        min_entries=1,
                        max_entries=len(colors)*2,
@@ -1,5 +1,7 @@
 from . import db
 
+from hashlib import blake2b
+
 
 class Project(db.Model):
     """
@@ -8,6 +10,8 @@ class Project(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(75), unique=True)
     max_count = db.Column(db.Integer)
+    batch_size = db.Column(db.Integer, default=1)
+    reuse_annotations = db.Column(db.Boolean, default=False)
 
     models = db.relationship("Model", backref='project', cascade="all, delete-orphan")
 
@@ -19,10 +23,15 @@ class Instance(db.Model):
     """
     Instance table in database.
     """
+    __table_args__ = (db.Index('instance_project_id_annotation_index', 'project_id', 'annotation'),
+                      db.Index('instance_model_id_annotation_index', 'model_id', 'annotation'),
+                      db.Index('instance_project_id_utterance_hash_index', 'project_id', 'utterance_hash'))
+
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
     model_id = db.Column(db.Integer, db.ForeignKey('model.id'))
-    utterance = db.Column(db.Text, index=True)
+    utterance = db.Column(db.Text)
+    utterance_hash = db.Column(db.BigInteger)
     annotation = db.Column(db.Integer, nullable=True)
     client_time = db.Column(db.Float, nullable=True)
     al_time = db.Column(db.Float, nullable=True)
@@ -34,6 +43,55 @@ class Instance(db.Model):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
+    @staticmethod
+    def hash_utterance(utterance):
+        """
+        Fixed width hash of an utterance for indexed lookups. Equal hashes have to be confirmed
+        by comparing the text.
+        :param utterance: text
+        :return: signed 64 bit integer
+        """
+        digest = blake2b(utterance.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'big', signed=True)
+
+    @classmethod
+    def find_annotated(cls, project_id, utterance):
+        """
+        Annotated instance of a project with the same utterance. A single probe of the
+        (project_id, utterance_hash) index. Skipped instances are not reused.
+        :param project_id:
+        :param utterance: text
+        :return: Instance or None
+        """
+        return cls.query.filter(db.and_(cls.project_id == project_id,
+                                        cls.utterance_hash == cls.hash_utterance(utterance),
+                                        cls.utterance == utterance,
+                                        cls.annotation.isnot(None),
+                                        cls.annotation != -1))\
+            .order_by(cls.id).first()
+
+    @classmethod
+    def find_model_annotations(cls, project_id, model_id, utterances, chunk_size=500):
+        """
+        Annotated instances of one model with one of the utterances, e.g. the annotations a client
+        missed while it was disconnected. Probes the (project_id, utterance_hash) index in chunks.
+        :param project_id:
+        :param model_id:
+        :param utterances: list of text
+        :param chunk_size: number of hashes per query
+        :return: list of Instance in order of id
+        """
+        hashes = sorted(set(cls.hash_utterance(utterance) for utterance in utterances))
+        utterances = set(utterances)
+        instances = list()
+        for i in range(0, len(hashes), chunk_size):
+            instances += cls.query.filter(db.and_(cls.project_id == project_id,
+                                                  cls.utterance_hash.in_(hashes[i:i + chunk_size]),
+                                                  cls.model_id == model_id,
+                                                  cls.annotation.isnot(None))).all()
+        return sorted((instance for instance in instances if instance.utterance in utterances),
+                      key=lambda instance: instance.id)
+
 
 class Model(db.Model):
     """
@@ -44,11 +102,12 @@ class Model(db.Model):
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     name = db.Column(db.String(75))
     project_id = db.Column(db.Integer, db.ForeignKey('project.id'))
-    sid = db.Column(db.String(100))
+    sid = db.Column(db.String(100), index=True)
     count = db.Column(db.Integer)
 
     instances = db.relationship("Instance", backref='model', cascade="all, delete-orphan")
     scores = db.relationship("Score", backref='model', cascade="all, delete-orphan")
+    stats = db.relationship("ModelStats", backref='model', uselist=False, cascade="all, delete-orphan")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -66,3 +125,91 @@ class Score(db.Model):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+
+
+class ModelStats(db.Model):
+    """
+    Aggregated counters per model. Updated incrementally whenever instances,
+    annotations or scores are written, so reading them does not scan the Instance table.
+    """
+    model_id = db.Column(db.Integer, db.ForeignKey('model.id'), primary_key=True)
+    num_instances = db.Column(db.Integer, default=0)
+    num_pos = db.Column(db.Integer, default=0)
+    num_neg = db.Column(db.Integer, default=0)
+    num_skip = db.Column(db.Integer, default=0)
+    num_copied = db.Column(db.Integer, default=0)
+    num_scores = db.Column(db.Integer, default=0)
+    # incremented whenever a score of the model is written, also if it replaces a score with the same count
+    score_version = db.Column(db.Integer, default=0)
+
+    annotation_columns = {1: 'num_pos', 0: 'num_neg', -1: 'num_skip'}
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+    @classmethod
+    def increment(cls, model_id, **deltas):
+        """
+        Add deltas to the counters of a model with a single UPDATE statement.
+        Creates the row if the model has no stats yet. Columns added to an existing database are
+        NULL until they are incremented the first time. Caller commits.
+        :param model_id:
+        :param deltas: column name -> value to add
+        """
+        deltas = {k: v for k, v in deltas.items() if v}
+        if not deltas:
+            return
+        values = {getattr(cls, k): db.func.coalesce(getattr(cls, k), 0) + v for k, v in deltas.items()}
+        updated = cls.query.filter_by(model_id=model_id).update(values, synchronize_session=False)
+        if updated == 0:
+            db.session.add(cls(model_id=model_id, **cls.zero(**deltas)))
+
+    @classmethod
+    def annotation_deltas(cls, annotation, delta=1):
+        """
+        Counter deltas for one annotation value.
+        :param annotation: 1, 0, -1 or None
+        :param delta: +1 to add, -1 to remove
+        :return: dict column name -> delta
+        """
+        column = cls.annotation_columns.get(annotation)
+        return {column: delta} if column is not None else {}
+
+    @classmethod
+    def zero(cls, **values):
+        """
+        All counters set to zero, updated with values.
+        :param values:
+        :return: dict column name -> value
+        """
+        counters = dict(num_instances=0, num_pos=0, num_neg=0, num_skip=0, num_copied=0, num_scores=0,
+                        score_version=0)
+        counters.update(values)
+        return counters
+
+    @classmethod
+    def rebuild(cls, model_id):
+        """
+        Recompute the counters of a model from the Instance and Score tables.
+        Used to fill the table for databases created before it existed. Caller commits.
+        :param model_id:
+        """
+        rows = db.session.query(Instance.annotation, Instance.copied, db.func.count(Instance.id))\
+            .filter(Instance.model_id == model_id)\
+            .group_by(Instance.annotation, Instance.copied).all()
+        counters = cls.zero()
+        for annotation, copied, num in rows:
+            counters['num_instances'] += num
+            if copied:
+                counters['num_copied'] += num
+            for column, delta in cls.annotation_deltas(annotation, num).items():
+                counters[column] += delta
+        counters['num_scores'] = Score.query.filter_by(model_id=model_id).count()
+        counters['score_version'] = counters['num_scores']
+
+        stats = cls.query.get(model_id)
+        if stats is None:
+            db.session.add(cls(model_id=model_id, **counters))
+        else:
+            for column, value in counters.items():
+                setattr(stats, column, value)
@@ -0,0 +1,193 @@
+from . import app, db, socketio, write_behind
+from .models import Project, Model, ModelStats
+from .plots import scores_f1_plot, scores_precision_plot, scores_recall_plot, \
+    al_time_plot, io_time_plot, client_time_plot, pos_neg_ratio_plot, annotation_time_plot, InstanceSeries
+
+from collections import OrderedDict
+import threading
+
+# plots built from the Score table
+score_plots = OrderedDict([('scores_f1', scores_f1_plot),
+                           ('scores_precision', scores_precision_plot),
+                           ('scores_recall', scores_recall_plot)])
+
+# plots built from the instance series of get_instance_series
+series_plots = OrderedDict([('al_time', al_time_plot),
+                            ('io_time', io_time_plot),
+                            ('client_time', client_time_plot),
+                            ('anno_time', annotation_time_plot),
+                            ('pos_neg_plot', pos_neg_ratio_plot)])
+
+
+class PlotCache(object):
+    """
+    Size bounded LRU cache for rendered bokeh components.
+    Keys are (project_id, plot kind, data version) tuples.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Look up rendered components and mark them as recently used.
+        :param key: (project_id, kind, version)
+        :return: (div, script) or None
+        """
+        with self.lock:
+            value = self.entries.get(key)
+            if value is not None:
+                self.entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        """
+        Store rendered components and evict the least recently used entries.
+        :param key: (project_id, kind, version)
+        :param value: (div, script)
+        """
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, project_id):
+        """
+        Drop all entries of a project.
+        :param project_id:
+        """
+        with self.lock:
+            for key in [k for k in self.entries if k[0] == project_id]:
+                del self.entries[key]
+
+
+cache = PlotCache(app.config.get('PLOT_CACHE_SIZE', 128))
+
+_scheduled = set()
+_scheduled_lock = threading.Lock()
+
+# InstanceSeries per project, built on first use and updated incrementally
+_series = dict()
+_series_lock = threading.Lock()
+
+
+def data_version(project_id):
+    """
+    Version of the data behind the plots of a project. Changes whenever a model count,
+    the number of instances or annotations of any model changes, a score is written
+    (also if it replaces a score with the same count) or models are renamed.
+    :param project_id:
+    :return: hashable version
+    """
+    rows = db.session.query(Model.id, Model.name, Model.count,
+                            ModelStats.num_instances, ModelStats.num_pos, ModelStats.num_neg,
+                            ModelStats.num_skip, ModelStats.num_copied, ModelStats.num_scores,
+                            ModelStats.score_version)\
+        .outerjoin(ModelStats, ModelStats.model_id == Model.id)\
+        .filter(Model.project_id == project_id)\
+        .order_by(Model.id).all()
+    return tuple(tuple(row) for row in rows)
+
+
+def get_plots(project_id):
+    """
+    Rendered components of all insight plots of a project. Only plots missing
+    in the cache for the current data version are built.
+    :param project_id:
+    :return: dict plot kind -> (div, script)
+    """
+    write_behind.flush()
+    version = data_version(project_id)
+    plots = dict()
+    series = None
+
+    for kind, plot_func in score_plots.items():
+        key = (project_id, kind, version)
+        plots[kind] = cache.get(key)
+        if plots[kind] is None:
+            plots[kind] = plot_func(project_id)
+            cache.put(key, plots[kind])
+
+    for kind, plot_func in series_plots.items():
+        key = (project_id, kind, version)
+        plots[kind] = cache.get(key)
+        if plots[kind] is None:
+            if series is None:
+                series = get_instance_series(project_id)
+            plots[kind] = plot_func(project_id, series)
+            cache.put(key, plots[kind])
+
+    return plots
+
+
+def get_instance_series(project_id):
+    """
+    Instance series of the time and annotation plots of a project. The first call reads all instances
+    of the project, later calls only the instances inserted since the previous call.
+    :param project_id:
+    :return: dict model_id -> dict series name -> list of values in insertion order
+    """
+    with _series_lock:
+        series = _series.get(project_id)
+        if series is None:
+            series = _series[project_id] = InstanceSeries(project_id)
+        series.update()
+        return series.series()
+
+
+def annotated(instance, annotation, submit_time):
+    """
+    Called when an instance is annotated, before the annotation is committed. Updates the series
+    of the project if it was built already.
+    :param instance: Instance
+    :param annotation: 1, 0 or -1
+    :param submit_time: timestamp of submission
+    """
+    annotation_time = submit_time - instance.show_time if instance.show_time is not None else None
+    with _series_lock:
+        series = _series.get(instance.project_id)
+        if series is not None:
+            series.annotated(instance.model_id, instance.id, annotation, annotation_time)
+
+
+def reset(project_id):
+    """
+    Forget everything cached for a project, e.g. after the project or models of it were deleted.
+    :param project_id:
+    """
+    with _series_lock:
+        _series.pop(project_id, None)
+    cache.invalidate(project_id)
+
+
+def invalidate(project_id):
+    """
+    Called when instances, annotations or scores of a project are written. Drops cached plots of the
+    project and, if PLOT_CACHE_PRERENDER is set, schedules rendering of the new version in the background.
+    :param project_id:
+    """
+    cache.invalidate(project_id)
+    if not app.config.get('PLOT_CACHE_PRERENDER', False):
+        return
+    with _scheduled_lock:
+        if project_id in _scheduled:
+            return
+        _scheduled.add(project_id)
+    socketio.start_background_task(_prerender, project_id)
+
+
+def _prerender(project_id):
+    """
+    Background task. Waits PLOT_CACHE_PRERENDER_DELAY seconds to collect further updates
+    and renders the plots of the project into the cache.
+    :param project_id:
+    """
+    socketio.sleep(app.config.get('PLOT_CACHE_PRERENDER_DELAY', 2))
+    with _scheduled_lock:
+        _scheduled.discard(project_id)
+    with app.app_context():
+        if Project.query.get(project_id) is not None:
+            get_plots(project_id)
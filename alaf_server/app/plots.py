@@ -4,12 +4,83 @@ from .models import Instance, Project
 from bokeh.plotting import figure
 from bokeh.embed import components
 import numpy as np
+from bisect import bisect_left
+from collections import defaultdict
 
 colors = ['#1f77b4', '#ff7f0e', '#2ca02c', '#d62728', '#9467bd', '#8c564b', '#e377c2',
           '#7f7f7f', '#bcbd22', '#17becf', '#aec7e8', '#ffbb78', '#98df8a', '#ff9896',
           '#c5b0d5', '#c49c94', '#f7b6d2', '#c7c7c7', '#dbdb8d', '#9edae5']
 
 
+class InstanceSeries(object):
+    """
+    Instance columns needed by the time and annotation plots of one project, per model in insertion order.
+    Kept in memory and updated incrementally: only instances inserted since the last update are read
+    from the database, annotations of instances which were already read are applied from annotated().
+    """
+
+    def __init__(self, project_id):
+        self.project_id = project_id
+        self.last_id = 0
+        # model_id -> column name -> list, one entry per instance
+        self.columns = defaultdict(lambda: defaultdict(list))
+        self.annotations = list()
+
+    def annotated(self, model_id, instance_id, annotation, annotation_time):
+        """
+        Remember the annotation of an instance, applied with the next update.
+        :param model_id:
+        :param instance_id:
+        :param annotation: 1, 0 or -1
+        :param annotation_time: seconds between show and submit time, None if not shown
+        """
+        self.annotations.append((model_id, instance_id, annotation, annotation_time))
+
+    def update(self):
+        """
+        Read instances inserted since the last update, one indexed range query, and apply annotations.
+        """
+        rows = db.session.query(Instance.id, Instance.model_id, Instance.annotation, Instance.al_time,
+                                Instance.io_time, Instance.client_time, Instance.show_time, Instance.submit_time)\
+            .filter(Instance.project_id == self.project_id, Instance.id > self.last_id)\
+            .order_by(Instance.id)
+        for instance_id, model_id, annotation, al_time, io_time, client_time, show_time, submit_time in rows:
+            columns = self.columns[model_id]
+            columns['id'].append(instance_id)
+            columns['al_time'].append(al_time)
+            columns['io_time'].append(io_time)
+            columns['client_time'].append(client_time)
+            columns['annotation'].append(annotation)
+            shown = submit_time is not None and show_time is not None
+            columns['annotation_time'].append(submit_time - show_time if shown else None)
+            self.last_id = instance_id
+
+        annotations, self.annotations = self.annotations, list()
+        for model_id, instance_id, annotation, annotation_time in annotations:
+            columns = self.columns.get(model_id)
+            if columns is None:
+                continue
+            position = bisect_left(columns['id'], instance_id)
+            if position < len(columns['id']) and columns['id'][position] == instance_id:
+                columns['annotation'][position] = annotation
+                columns['annotation_time'][position] = annotation_time
+
+    def series(self):
+        """
+        :return: dict model_id -> dict series name -> list of values in insertion order. Annotation times
+        only of annotated instances, annotations without skipped (-1) and pending instances.
+        """
+        series = defaultdict(lambda: defaultdict(list))
+        for model_id, columns in self.columns.items():
+            model_series = series[model_id]
+            model_series['al_time'] = list(columns['al_time'])
+            model_series['io_time'] = list(columns['io_time'])
+            model_series['client_time'] = list(columns['client_time'])
+            model_series['annotation_time'] = [t for t in columns['annotation_time'] if t is not None]
+            model_series['annotation'] = [a for a in columns['annotation'] if a is not None and a != -1]
+        return series
+
+
 def get_plot(project_id, data_func, title, x_axis_label, y_axis_label, avg=False, median=False):
     """
     Helper function to build plot using bokeh.
@@ -103,16 +174,19 @@ def scores_recall_plot(project_id):
                     avg=True)
 
 
-def annotation_time_plot(project_id):
+def annotation_time_plot(project_id, series=None):
     """
     Build plot for annotation time.
     :param project_id:
+    :param series: instance series from get_instance_series, read from database if None
     :return: bokeh components
     """
+    if series is None:
+        series = get_instance_series(project_id)
+
     def data_func(model):
-        instances = Instance.query.filter(db.and_(Instance.model_id == model.id,
-                                                  Instance.submit_time.isnot(None))).order_by(Instance.id).all()
-        return [i for i in range(len(instances))], [i.submit_time - i.show_time for i in instances]
+        y = series.get(model.id, {}).get('annotation_time', [])
+        return [i for i in range(len(y))], y
 
     return get_plot(project_id=project_id,
                     data_func=data_func,
@@ -122,15 +196,19 @@ def annotation_time_plot(project_id):
                     median=True)
 
 
-def al_time_plot(project_id):
+def al_time_plot(project_id, series=None):
     """
     Build plot for active learning time.
     :param project_id:
+    :param series: instance series from get_instance_series, read from database if None
     :return: bokeh components
     """
+    if series is None:
+        series = get_instance_series(project_id)
+
     def data_func(model):
-        instances = Instance.query.filter_by(model_id=model.id).order_by(Instance.id).all()
-        return [i for i in range(len(instances))], [i.al_time for i in instances]
+        y = series.get(model.id, {}).get('al_time', [])
+        return [i for i in range(len(y))], y
 
     return get_plot(project_id=project_id,
                     data_func=data_func,
@@ -139,15 +217,19 @@ def al_time_plot(project_id):
                     y_axis_label='seconds')
 
 
-def io_time_plot(project_id):
+def io_time_plot(project_id, series=None):
     """
     Build plot for I/O time.
     :param project_id:
+    :param series: instance series from get_instance_series, read from database if None
     :return: bokeh components
     """
+    if series is None:
+        series = get_instance_series(project_id)
+
     def data_func(model):
-        instances = Instance.query.filter_by(model_id=model.id).order_by(Instance.id).all()
-        return [i for i in range(len(instances))], [i.io_time for i in instances]
+        y = series.get(model.id, {}).get('io_time', [])
+        return [i for i in range(len(y))], y
 
     return get_plot(project_id=project_id,
                     data_func=data_func,
@@ -156,15 +238,19 @@ def io_time_plot(project_id):
                     y_axis_label='seconds')
 
 
-def client_time_plot(project_id):
+def client_time_plot(project_id, series=None):
     """
     Build plot for time spent on client.
     :param project_id:
+    :param series: instance series from get_instance_series, read from database if None
     :return: bokeh components
     """
+    if series is None:
+        series = get_instance_series(project_id)
+
     def data_func(model):
-        instances = Instance.query.filter_by(model_id=model.id).order_by(Instance.id).all()
-        return [i for i in range(len(instances))], [i.client_time for i in instances]
+        y = series.get(model.id, {}).get('client_time', [])
+        return [i for i in range(len(y))], y
 
     return get_plot(project_id=project_id,
                     data_func=data_func,
@@ -173,23 +259,23 @@ def client_time_plot(project_id):
                     y_axis_label='seconds')
 
 
-def pos_neg_ratio_plot(project_id):
+def pos_neg_ratio_plot(project_id, series=None):
     """
     Build plot for ratio between positive and negative instances.
     :param project_id:
+    :param series: instance series from get_instance_series, read from database if None
     :return: bokeh components
     """
+    if series is None:
+        series = get_instance_series(project_id)
+
     def data_func(model):
-        annotations = Instance.query.with_entities(Instance.annotation)\
-            .filter(db.and_(Instance.annotation.isnot(None),
-                            Instance.annotation != -1,
-                            Instance.model_id == model.id))\
-            .order_by(Instance.id).all()
+        annotations = series.get(model.id, {}).get('annotation', [])
 
         y = list()
         pos_neg = {1: 0, 0: 0}
         for annotation in annotations:
-            pos_neg[annotation[0]] += 1
+            pos_neg[annotation] += 1
             pos, neg = float(pos_neg[1]), pos_neg[0]
             ratio = (pos / neg) if neg > 0 else 0
             y.append(ratio)
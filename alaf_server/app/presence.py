@@ -0,0 +1,91 @@
+from . import socketio, write_behind
+from .models import Model
+
+from collections import OrderedDict
+import threading
+
+# project_id -> OrderedDict model_id -> status entry. Filled from the database on first access and
+# kept up to date by the socket handlers afterwards. Only valid for a single server process.
+_projects = dict()
+_lock = threading.Lock()
+
+
+def room(project_id):
+    """
+    Socket.IO room of browsers subscribed to the model status of a project.
+    :param project_id:
+    :return: room name
+    """
+    return 'status_{}'.format(project_id)
+
+
+def _load(project_id):
+    """
+    Read the model status of a project from the database. Model is online if sid is saved in database.
+    :param project_id:
+    :return: OrderedDict model_id -> status entry
+    """
+    write_behind.flush()
+    models = Model.query.with_entities(Model.id, Model.name, Model.sid, Model.count)\
+        .filter_by(project_id=project_id).order_by(Model.id).all()
+    return OrderedDict((model_id, {'name': name, 'status': sid is not None, 'count': count})
+                       for model_id, name, sid, count in models)
+
+
+def get_status(project_id):
+    """
+    Current model status of a project.
+    :param project_id:
+    :return: list of model name, connection status, current annotated instances
+    """
+    with _lock:
+        if project_id not in _projects:
+            _projects[project_id] = _load(project_id)
+        entries = list(_projects[project_id].values())
+
+    response = list()
+    for entry in entries:
+        count = entry['count']
+        if count is not None:
+            count += 1
+        response.append({'name': entry['name'], 'status': entry['status'], 'count': count})
+    return response
+
+
+def update(project_id, model_id, **changes):
+    """
+    Update the status of a model and push the project status to subscribed browsers if it changed.
+    Projects nobody has looked at yet are not tracked, they are read from the database on first access.
+    :param project_id:
+    :param model_id:
+    :param changes: status and/or count
+    """
+    with _lock:
+        entry = _projects.get(project_id, {}).get(model_id)
+        if entry is None or all(entry[k] == v for k, v in changes.items()):
+            return
+        entry.update(changes)
+    push(project_id)
+
+
+def reset(project_id):
+    """
+    Forget the status of a project, e.g. after models were added, renamed or deleted,
+    and push the status read from the database.
+    :param project_id:
+    """
+    with _lock:
+        _projects.pop(project_id, None)
+    push(project_id)
+
+
+def push(project_id, sid=None):
+    """
+    Send the model status of a project to all subscribed browsers or a single one.
+    :param project_id:
+    :param sid: send only to this browser
+    """
+    socketio.emit('model_status',
+                  {'models': get_status(project_id)},
+                  room=sid if sid is not None else room(project_id),
+                  namespace='/status')
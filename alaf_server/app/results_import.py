@@ -0,0 +1,82 @@
+from . import db, plot_cache, presence, write_behind
+from .models import Instance, Model, ModelStats
+
+import zipfile
+import numpy as np
+
+# columns of the results file written by the headless simulation of the client (alaf_client/simulate.py)
+instance_columns = ('utterance', 'label', 'count', 'client_time', 'al_time')
+score_columns = ('score_count', 'precision', 'recall', 'f1')
+
+
+def load_results(file):
+    """
+    Read the columns of a results file. Pickled data is not accepted.
+    :param file: path or file object of the .npz file
+    :return: dict column name -> numpy array
+    :raises ValueError: if the file is no results file
+    """
+    try:
+        with np.load(file, allow_pickle=False) as results:
+            columns = {name: results[name] for name in results.files}
+    except (OSError, ValueError, zipfile.BadZipFile) as e:
+        raise ValueError('not a results file: {}'.format(e))
+
+    missing = [name for name in instance_columns + score_columns + ('model_name', 'final_count')
+               if name not in columns]
+    if missing:
+        raise ValueError('missing columns: {}'.format(', '.join(missing)))
+    for group in (instance_columns, score_columns):
+        if len(set(len(columns[name]) for name in group)) > 1:
+            raise ValueError('columns {} differ in length'.format(', '.join(group)))
+    return columns
+
+
+def import_results(project, columns, model_name=None):
+    """
+    Bulk load a simulation into a model of the project, the model is created if it does not exist.
+    Instances and scores go through write_behind like the rows sent by connected clients, so ModelStats
+    and Model.count are updated in the same transaction. Simulated instances have no io and annotation time.
+    :param project: Project
+    :param columns: dict column name -> numpy array, see load_results
+    :param model_name: name of the model, default the name stored in the results file
+    :return: Model, number of imported instances and scores
+    :raises ValueError: if the model already has instances or scores
+    """
+    model_name = model_name or str(columns['model_name'])
+    write_behind.flush()
+    model = Model.query.filter_by(project_id=project.id, name=model_name).first()
+    if model is None:
+        model = Model(name=model_name, project_id=project.id, count=0)
+        db.session.add(model)
+        db.session.commit()
+        presence.reset(project.id)
+    else:
+        stats = ModelStats.query.get(model.id)
+        if stats is not None and (stats.num_instances or stats.num_scores):
+            raise ValueError("model '{}' already has instances or scores".format(model_name))
+
+    instances = list()
+    for utterance, label, client_time, al_time in zip(columns['utterance'].tolist(), columns['label'].tolist(),
+                                                      columns['client_time'].tolist(), columns['al_time'].tolist()):
+        instances.append(dict(utterance=utterance,
+                              utterance_hash=Instance.hash_utterance(utterance),
+                              annotation=label,
+                              project_id=project.id,
+                              model_id=model.id,
+                              client_time=client_time,
+                              al_time=al_time,
+                              io_time=0.0,
+                              show_time=None,
+                              submit_time=None,
+                              copied=0))
+    write_behind.add_instances(instances, int(columns['final_count']))
+
+    for count, precision, recall, f1 in zip(columns['score_count'].tolist(), columns['precision'].tolist(),
+                                            columns['recall'].tolist(), columns['f1'].tolist()):
+        write_behind.add_score(dict(model_id=model.id, precision=precision, recall=recall, f1=f1, count=count))
+    write_behind.flush()
+
+    plot_cache.invalidate(project.id)
+    presence.update(project.id, model.id, count=int(columns['final_count']))
+    return model, len(instances), len(columns['score_count'])
@@ -0,0 +1,88 @@
+from .models import Project, Model
+
+from collections import namedtuple
+import threading
+
+Session = namedtuple('Session', ['model_id', 'project_id', 'max_count', 'batch_size', 'reuse_annotations', 'name'])
+
+# sid -> Session of every registered model client and the reverse model_id -> sid.
+# Only valid for a single server process, the database stays the source of truth.
+_sessions = dict()
+_sids = dict()
+_lock = threading.Lock()
+
+
+def register(sid, model, project):
+    """
+    Remember the session of a registered model client. A previous session of the same model is dropped.
+    :param sid: socket sid of the client
+    :param model: Model
+    :param project: Project of the model
+    :return: Session
+    """
+    session = Session(model_id=model.id,
+                      project_id=project.id,
+                      max_count=project.max_count,
+                      batch_size=project.batch_size or 1,
+                      reuse_annotations=bool(project.reuse_annotations),
+                      name=model.name)
+    with _lock:
+        old_sid = _sids.get(model.id)
+        if old_sid is not None:
+            _sessions.pop(old_sid, None)
+        _sessions[sid] = session
+        _sids[model.id] = sid
+    return session
+
+
+def get(sid):
+    """
+    Session of a model client. Falls back to the database on a miss, e.g. after invalidate_project.
+    :param sid: socket sid of the client
+    :return: Session or None if no model is registered with this sid
+    """
+    session = _sessions.get(sid)
+    if session is not None:
+        return session
+
+    model = Model.query.filter_by(sid=sid).one_or_none()
+    if model is None:
+        return None
+    return register(sid, model, Project.query.get(model.project_id))
+
+
+def remove(sid):
+    """
+    Forget the session of a disconnected or finished model client.
+    :param sid: socket sid of the client
+    :return: removed Session or None
+    """
+    with _lock:
+        session = _sessions.pop(sid, None)
+        if session is not None and _sids.get(session.model_id) == sid:
+            del _sids[session.model_id]
+    return session
+
+
+def sid_of(model_id):
+    """
+    Socket sid of a model client.
+    :param model_id:
+    :return: sid or None if the model is offline
+    """
+    sid = _sids.get(model_id)
+    if sid is not None:
+        return sid
+    return Model.query.with_entities(Model.sid).filter_by(id=model_id).scalar()
+
+
+def invalidate_project(project_id):
+    """
+    Drop the sessions of a project after the project or its models changed. They are read
+    from the database again on the next event of each client.
+    :param project_id:
+    """
+    with _lock:
+        for sid in [sid for sid, s in _sessions.items() if s.project_id == project_id]:
+            session = _sessions.pop(sid)
+            _sids.pop(session.model_id, None)
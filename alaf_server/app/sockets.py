@@ -1,9 +1,21 @@
 from . import db, socketio
-from .models import Project, Instance, Model, Score
+from .models import Project, Instance, Model, ModelStats
+from .annotation_queue import pending_instance
+from . import annotation_queue, plot_cache, presence, sessions, write_behind
 import time
+import threading
 from flask import request
+from flask_socketio import join_room
 from sqlalchemy.orm.exc import NoResultFound
 
+# project_id of every connected annotator (browser) by sid
+annotator_projects = dict()
+# sids of annotators without an instance to annotate, per project in order of arrival
+waiting_annotators = dict()
+# id of the instance shown to an annotator by sid, released when the annotator leaves
+annotator_instances = dict()
+annotators_lock = threading.Lock()
+
 
 @socketio.on('utterance', namespace='/model')
 def receive_utterance(message):
@@ -12,63 +24,98 @@ def receive_utterance(message):
     :param message: utterance, times, count
     :return:
     """
+    session = sessions.get(request.sid)
+    if session is None:
+        print('utterance from unregistered client: {}'.format(request.sid))
+        return
+
+    store_utterances(session, [message], message)
+    print(message)
+
+
+@socketio.on('utterances', namespace='/model')
+def receive_utterances(message):
+    """
+    Batch mode. Receive all utterances a client proposed in one round and save them in one transaction.
+    :param message: utterances (list of utterance, label), times, count
+    :return:
+    """
+    session = sessions.get(request.sid)
+    if session is None:
+        print('utterances from unregistered client: {}'.format(request.sid))
+        return
+
+    store_utterances(session, message['utterances'], message)
+    print(message)
+
+
+def store_utterances(session, utterances, message):
+    """
+    Save utterances proposed by a client in one round. Times of the round are split evenly
+    between its utterances. Finishes the client if max_count is reached.
+    :param session: Session of the client
+    :param utterances: list of dicts with utterance and label
+    :param message: times and count of the round
+    :return:
+    """
     client_time = message['client_time']
     al_time = message['al_time']
     io_time = (time.time() - message['io_time_start']) - client_time
     count = message['count']
-    utterance = message['utterance']
-    model = Model.query.filter_by(sid=request.sid).one_or_none()
-    project = Project.query.get(model.project_id)
 
     # if max_count is reached, finish client
-    if count >= project.max_count:
-        print("model: '{}' finished with {} instances".format(model.name, model.count))
+    if count >= session.max_count:
+        print("model: '{}' finished with {} instances".format(session.name, count))
         socketio.emit('finished',
-                      {'cause': "max count: {} reached".format(project.max_count)},
-                      room=model.sid,
+                      {'cause': "max count: {} reached".format(session.max_count)},
+                      room=request.sid,
                       namespace='/model')
-        model.sid = None
+        Model.query.filter_by(id=session.model_id).update({'sid': None})
         db.session.commit()
+        sessions.remove(request.sid)
+        presence.update(session.project_id, session.model_id, status=False)
         return
 
-    # default None. Clients can send annotation in case of baselines from annotated data
-    annotation = message.get('label')
-
-    show_time = None
-    submit_time = None
-    copied = 0
-    found_instance = None
-
-    # code to copy already labeled instances if present in database.
-    # TODO: add option to activate this in project settings
-    # if instance found in db, use this label
-    #found_instance = Instance.query.filter_by(utterance=utterance).first()
-    #if found_instance is not None and annotation is None:
-    #    annotation = found_instance.annotation
-    #    show_time = time.time()
-    #    submit_time = show_time + (found_instance.submit_time - found_instance.show_time)
-    #    copied = 1
-
-    model.count = count
-    instance = Instance(utterance=utterance,
-                        annotation=annotation,
-                        project_id=model.project_id,
-                        model_id=model.id,
-                        client_time=client_time,
-                        al_time=al_time,
-                        io_time=io_time,
-                        show_time=show_time,
-                        submit_time=submit_time,
-                        copied=copied)
-    db.session.add(instance)
-    db.session.commit()
+    instances = list()
+    for item in utterances:
+        # default None. Clients can send annotation in case of baselines from annotated data
+        annotation = item.get('label')
 
-    # instance was found in database and automatically labeled
-    if found_instance is not None and message.get('label') is None and annotation is not None:
-        print('instance found in database, label: {}'.format(annotation))
-        send_annotation(instance)
+        show_time = None
+        submit_time = None
+        copied = 0
 
-    print(message)
+        # copy the label if another model of the project already proposed this utterance
+        if session.reuse_annotations and annotation is None:
+            found_instance = Instance.find_annotated(session.project_id, item['utterance'])
+            if found_instance is not None:
+                annotation = found_instance.annotation
+                show_time = time.time()
+                submit_time = show_time
+                if found_instance.submit_time is not None and found_instance.show_time is not None:
+                    submit_time += found_instance.submit_time - found_instance.show_time
+                copied = 1
+
+        instances.append(dict(utterance=item['utterance'],
+                              utterance_hash=Instance.hash_utterance(item['utterance']),
+                              annotation=annotation,
+                              project_id=session.project_id,
+                              model_id=session.model_id,
+                              client_time=client_time / len(utterances),
+                              al_time=al_time / len(utterances),
+                              io_time=io_time,
+                              show_time=show_time,
+                              submit_time=submit_time,
+                              copied=copied))
+    write_behind.add_instances(instances, count)
+    plot_cache.invalidate(session.project_id)
+    presence.update(session.project_id, session.model_id, count=count)
+
+    for instance in instances:
+        if instance['copied']:
+            send_annotation(Instance(**instance))
+        elif instance['annotation'] is None:
+            push_to_waiting_annotator(session.project_id)
 
 
 @socketio.on('scores', namespace='/model')
@@ -78,14 +125,17 @@ def receive_scores(message):
     :param message: model_id, scores, count
     :return:
     """
-    model = Model.query.filter_by(sid=request.sid).one_or_none()
-    score = Score(model_id=model.id,
-                  precision=message['precision'],
-                  recall=message['recall'],
-                  f1=message['f1'],
-                  count=message['count'])
-    db.session.add(score)
-    db.session.commit()
+    session = sessions.get(request.sid)
+    if session is None:
+        print('scores from unregistered client: {}'.format(request.sid))
+        return
+    score = dict(model_id=session.model_id,
+                 precision=message['precision'],
+                 recall=message['recall'],
+                 f1=message['f1'],
+                 count=message['count'])
+    write_behind.add_score(score)
+    plot_cache.invalidate(session.project_id)
     print(message)
 
 
@@ -93,12 +143,15 @@ def receive_scores(message):
 def on_register(message):
     """
     Check if project and model name are sent by client are available in database.
-    If available, tag as online and ask for next utterance, otherwise send finished message to client.
-    :param message: project_name, model_name
+    If available, tag as online, acknowledge with 'registered' and ask for next utterance, otherwise
+    send finished message to client. Annotations of pending utterances which the client did not receive,
+    e.g. while it was disconnected, are sent again.
+    :param message: project_name, model_name, count, pending: utterances waiting for an annotation
     :return:
     """
     project_name = message['project_name']
     model_name = message['model_name']
+    write_behind.flush()
 
     try:
         project = Project.query.filter_by(name=project_name).one()
@@ -115,12 +168,22 @@ def on_register(message):
     model.sid = request.sid
     model.count = message['count']
     db.session.commit()
+    sessions.register(request.sid, model, project)
+    presence.update(model.project_id, model.id, status=True, count=model.count)
 
-    instance = Instance.query.filter(db.and_(Instance.annotation.is_(None),
-                                             Instance.model_id == model.id)).first()
-    if instance is None:
+    socketio.emit('registered',
+                  {'count': model.count, 'batch_size': project.batch_size or 1},
+                  room=request.sid,
+                  namespace='/model')
+    resent = Instance.find_model_annotations(project.id, model.id, message.get('pending') or [])
+    for instance in resent:
+        send_annotation(instance)
+
+    # a re-sent annotation can complete the round of the client, it proposes the next round itself
+    instance = pending_instance(model.id)
+    if instance is None and not resent:
         socketio.emit('next_utterance',
-                      {'io_time_start': time.time()},
+                      {'io_time_start': time.time(), 'batch_size': project.batch_size or 1},
                       room=model.sid,
                       namespace='/model')
 
@@ -140,13 +203,27 @@ def on_disconnect():
     Mark client as disconnected by deleting sid from model in databse.
     :return:
     """
-    model = Model.query.filter_by(sid=request.sid).one_or_none()
-    if model:
-        model.sid = None
+    session = sessions.get(request.sid)
+    if session:
+        Model.query.filter_by(id=session.model_id).update({'sid': None})
         db.session.commit()
+        sessions.remove(request.sid)
+        presence.update(session.project_id, session.model_id, status=False)
     print('disconnect: ' + request.sid)
 
 
+@socketio.on('subscribe', namespace='/status')
+def on_status_subscribe(message):
+    """
+    Browser subscribes to the model status of a project. Sends the current status
+    and pushes every change afterwards.
+    :param message: project_id
+    """
+    project_id = int(message['project_id'])
+    join_room(presence.room(project_id))
+    presence.push(project_id, sid=request.sid)
+
+
 def send_annotation(instance):
     """
     Send human annotation to client.
@@ -156,13 +233,144 @@ def send_annotation(instance):
     if instance.annotation is None:
         print('tried to send instance without annotation: {}'.format(instance))
         return
-    model = Model.query.get(instance.model_id)
+    sid = sessions.sid_of(instance.model_id)
+    if sid is None:
+        # the client gets the annotation when it registers again
+        print('model {} is offline, annotation is sent on register'.format(instance.model_id))
+        return
+    session = sessions.get(sid)
     io_time_start = time.time()
     message = {'utterance': instance.utterance,
                'annotation': instance.annotation,
-               'io_time_start': io_time_start}
+               'io_time_start': io_time_start,
+               'batch_size': session.batch_size if session is not None else 1}
     socketio.emit('annotation',
                   message,
-                  room=model.sid,
+                  room=sid,
                   namespace='/model')
 
+
+def annotate_instance(instance_id, annotation, submit_time, project_id=None):
+    """
+    Store human annotation of an instance and send it to the model which proposed the instance.
+    Only the first annotation of an instance is stored and sent, the model would otherwise add
+    the instance twice. A conditional UPDATE decides between annotators submitting at the same time.
+    :param instance_id:
+    :param annotation: 1, 0 or -1
+    :param submit_time: timestamp of submission
+    :param project_id: project of the annotator, instances of other projects are not found
+    :return: annotated instance or None if not found
+    """
+    instance = Instance.query.get(instance_id)
+    if instance is None or (project_id is not None and instance.project_id != project_id):
+        return None
+
+    annotated = Instance.query.filter(db.and_(Instance.id == instance_id,
+                                              Instance.annotation.is_(None)))\
+        .update({'annotation': annotation, 'submit_time': submit_time}, synchronize_session=False)
+    if annotated == 0:
+        db.session.rollback()
+        print('instance {} is already annotated'.format(instance_id))
+        return instance
+    ModelStats.increment(instance.model_id, **ModelStats.annotation_deltas(annotation))
+    plot_cache.annotated(instance, annotation, submit_time)
+    db.session.commit()
+    db.session.refresh(instance)
+    plot_cache.invalidate(instance.project_id)
+
+    send_annotation(instance)
+    return instance
+
+
+def push_next_instance(sid, project_id):
+    """
+    Send the next unannotated instance of the project to an annotator. If there is none,
+    the annotator waits until a model proposes a new utterance.
+    :param sid: annotator sid
+    :param project_id:
+    :return: True if an instance was sent
+    """
+    try:
+        instance = annotation_queue.next_instance(project_id)
+    except AttributeError as e:
+        print(e)
+        instance = None
+
+    if instance is None:
+        with annotators_lock:
+            waiting = waiting_annotators.setdefault(project_id, [])
+            if sid not in waiting:
+                waiting.append(sid)
+        return False
+
+    with annotators_lock:
+        annotator_instances[sid] = instance.id
+    socketio.emit('instance',
+                  {'instance_id': instance.id, 'utterance': instance.utterance},
+                  room=sid,
+                  namespace='/annotator')
+    return True
+
+
+def push_to_waiting_annotator(project_id):
+    """
+    Called for every new unannotated instance. Hands it to the annotator who waits the longest.
+    Shown instances are leased (see annotation_queue.next_instance), so every waiting annotator
+    gets a different instance when a batch of instances arrives.
+    :param project_id:
+    """
+    with annotators_lock:
+        waiting = waiting_annotators.get(project_id)
+        if not waiting:
+            return
+        sid = waiting.pop(0)
+    push_next_instance(sid, project_id)
+
+
+@socketio.on('join', namespace='/annotator')
+def on_annotator_join(message):
+    """
+    Annotator opened the annotation page of a project. Join the project room and send the first instance.
+    :param message: project_id
+    """
+    project_id = int(message['project_id'])
+    with annotators_lock:
+        annotator_projects[request.sid] = project_id
+    join_room('project_{}'.format(project_id))
+    push_next_instance(request.sid, project_id)
+
+
+@socketio.on('annotate', namespace='/annotator')
+def on_annotator_annotate(message):
+    """
+    Receives annotation from the annotator and sends the next instance back over the same socket.
+    :param message: instance_id, annotation
+    """
+    submit_time = time.time()
+    instance_id = message.get('instance_id')
+    with annotators_lock:
+        annotator_instances.pop(request.sid, None)
+    project_id = annotator_projects.get(request.sid)
+    if instance_id is not None and project_id is not None:
+        annotate_instance(instance_id, message['annotation'], submit_time, project_id)
+
+    if project_id is not None:
+        push_next_instance(request.sid, project_id)
+
+
+@socketio.on('disconnect', namespace='/annotator')
+def on_annotator_disconnect():
+    """
+    Forget disconnected annotator. The instance shown to the annotator is handed to a waiting annotator.
+    :return:
+    """
+    with annotators_lock:
+        project_id = annotator_projects.pop(request.sid, None)
+        instance_id = annotator_instances.pop(request.sid, None)
+        waiting = waiting_annotators.get(project_id, [])
+        if request.sid in waiting:
+            waiting.remove(request.sid)
+    if instance_id is not None:
+        annotation_queue.release(instance_id)
+        if project_id is not None:
+            push_to_waiting_annotator(project_id)
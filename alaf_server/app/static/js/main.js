@@ -4,24 +4,40 @@
 
     angular.module('ActiveLearningAnnotationFrameworkAPP', ['cfp.hotkeys'])
 
-        .controller('AlafAnnotationController', ['$scope', '$log', '$http', '$sce', '$timeout',
-            function ($scope, $log, $http, $sce, $timeout) {
+        .controller('AlafAnnotationController', ['$scope', '$log',
+            function ($scope, $log) {
+                var socket = null;
+
+                $scope.init = function (project_id) {
+                    $scope.instance_id = null;
+                    $scope.utterance = null;
+                    socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port + '/annotator');
+
+                    // (re)join the project room, the server answers with the next instance
+                    socket.on('connect', function () {
+                        socket.emit('join', {'project_id': project_id});
+                    });
+
+                    // pushed by the server as soon as an instance is available
+                    socket.on('instance', function (message) {
+                        $scope.$apply(function () {
+                            $scope.instance_id = message['instance_id'];
+                            $scope.utterance = message['utterance'];
+                        });
+                    });
+                };
 
                 $scope.annotate = function (annotation) {
 
                     var instance_id = $scope.instance_id;
                     $log.log(instance_id);
+                    if (instance_id === null) {
+                        return;
+                    }
 
-                    $http.post('/annotate', {'instance_id': instance_id, 'annotation': annotation}).then(
-                        function successCallback(response) {
-                            $log.log(response);
-                            $scope.nextInstance()
-                        },
-
-                        function errorCallback(response) {
-                            $log.log(response);
-                        }
-                    );
+                    $scope.instance_id = null;
+                    $scope.utterance = null;
+                    socket.emit('annotate', {'instance_id': instance_id, 'annotation': annotation});
                 };
                 $scope.annotatePos = function (annotation) {
                     $scope.annotate(1);
@@ -33,24 +49,6 @@
                     $scope.annotate(-1);
                 };
 
-                $scope.nextInstance = function () {
-
-                    $http.get('./instance/next').then(
-                        function successCallback(response) {
-                            $log.log('success');
-                            $scope.instance_id = response.data['instance_id'];
-                            $scope.utterance = response.data['utterance'];
-                        },
-                        function errorCallback(response) {
-                            $log.log(response);
-                            $log.log('fail');
-                            $scope.instance_id = null;
-                            $scope.utterance = null;
-                            $timeout($scope.nextInstance, 1000, true);
-                        }
-                    );
-
-                };
         $scope.annotateByKey = function(keyEvent) {
             if (keyEvent.which === 65){
                 $log.log('press')
@@ -65,19 +63,84 @@
 
         ])
 
-        .controller('AlafModelStatusController', ['$scope', '$log', '$http', '$sce', '$timeout',
-            function ($scope, $log, $http, $sce, $timeout) {
+        .controller('AlafModelStatusController', ['$scope', '$log',
+            function ($scope, $log) {
                 $scope.model_status = function (project_id) {
-                    $http.get('/project/' + project_id + '/status').then(
+                    var socket = io.connect(location.protocol + '//' + document.domain + ':' + location.port + '/status');
+
+                    socket.on('connect', function () {
+                        socket.emit('subscribe', {'project_id': project_id});
+                    });
+
+                    // pushed by the server on every status change
+                    socket.on('model_status', function (message) {
+                        $log.log(message['models']);
+                        $scope.$apply(function () {
+                            $scope.models = message['models'];
+                        });
+                    });
+                };
+            }
+        ])
+
+        .controller('AlafInstancesController', ['$scope', '$log', '$http', '$window',
+            function ($scope, $log, $http, $window) {
+                var clazz = {'0': 'table-danger', '1': 'table-success', 'null': 'table-dark', '-1': ''};
+                // requests of a previous filter setting are dropped when they arrive late
+                var generation = 0;
+
+                $scope.init = function (project_id) {
+                    $scope.project_id = project_id;
+                    $scope.filter = {'model_id': '', 'annotation': ''};
+                    $scope.reload();
+
+                    angular.element($window).on('scroll', function () {
+                        if ($window.innerHeight + $window.pageYOffset >= document.body.offsetHeight - 300) {
+                            $scope.$apply($scope.loadPage);
+                        }
+                    });
+                };
+
+                $scope.reload = function () {
+                    generation += 1;
+                    $scope.instances = [];
+                    $scope.cursor = null;
+                    $scope.done = false;
+                    $scope.loading = false;
+                    $scope.loadPage();
+                };
+
+                $scope.loadPage = function () {
+                    if ($scope.loading || $scope.done) {
+                        return;
+                    }
+                    $scope.loading = true;
+                    var request_generation = generation;
+                    var params = {'limit': 100,
+                                  'model_id': $scope.filter.model_id,
+                                  'annotation': $scope.filter.annotation};
+                    if ($scope.cursor !== null) {
+                        params['before'] = $scope.cursor;
+                    }
+
+                    $http.get('/project/' + $scope.project_id + '/instances/page', {'params': params}).then(
                         function successCallback(response) {
-                            $log.log(response.data['models']);
-                            $scope.models = response.data['models']
+                            if (request_generation !== generation) {
+                                return;
+                            }
+                            angular.forEach(response.data['instances'], function (instance) {
+                                instance.clazz = clazz[String(instance.annotation)];
+                                $scope.instances.push(instance);
+                            });
+                            $scope.cursor = response.data['next'];
+                            $scope.done = $scope.cursor === null;
+                            $scope.loading = false;
                         },
                         function errorCallback(response) {
                             $log.log(response);
+                            $scope.loading = false;
                         }
                     );
-                    $timeout($scope.model_status, 5000, true, project_id);
                 };
             }
         ])
@@ -1,14 +1,12 @@
 from . import app, db
-from .models import Project, Instance, Model
+from .models import Project, Instance, Model, ModelStats
 from .forms import EditProjectForm, DeleteProjectForm
-from .sockets import send_annotation
-from .plots import scores_f1_plot, scores_precision_plot, scores_recall_plot, \
-    al_time_plot, io_time_plot, client_time_plot, pos_neg_ratio_plot, annotation_time_plot
+from .sockets import annotate_instance
+from . import annotation_queue, plot_cache, presence, results_import, sessions, write_behind
 
 from flask import request, jsonify, render_template, redirect, flash
 import json
 import time
-from random import choice
 
 
 @app.route('/', methods=['GET', 'POST'])
@@ -37,8 +35,13 @@ def project_overview(project_id):
 
     # delete button
     if form.delete.data is True:
+        # buffered rows of the project must not be written after it is deleted
+        write_behind.flush()
         db.session.delete(project)
         db.session.commit()
+        plot_cache.reset(project_id)
+        presence.reset(project_id)
+        sessions.invalidate_project(project_id)
         flash("Project '{}' deleted".format(project.name), 'danger')
         return redirect('/projects')
 
@@ -54,24 +57,29 @@ def project_insights(project_id):
     """
     project = Project.query.get(project_id)
 
+    plots = plot_cache.get_plots(project_id)
     # scores
-    div_scores_f1, script_scores_f1 = scores_f1_plot(project_id)
-    div_scores_precision, script_scores_precision = scores_precision_plot(project_id)
-    div_scores_recall, script_scores_recall = scores_recall_plot(project_id)
+    div_scores_f1, script_scores_f1 = plots['scores_f1']
+    div_scores_precision, script_scores_precision = plots['scores_precision']
+    div_scores_recall, script_scores_recall = plots['scores_recall']
     # time
-    div_al_time, script_al_time = al_time_plot(project_id)
-    div_io_time, script_io_time = io_time_plot(project_id)
-    div_client_time, script_client_time = client_time_plot(project_id)
-    div_anno_time, script_anno_time = annotation_time_plot(project_id)
+    div_al_time, script_al_time = plots['al_time']
+    div_io_time, script_io_time = plots['io_time']
+    div_client_time, script_client_time = plots['client_time']
+    div_anno_time, script_anno_time = plots['anno_time']
     # stats
-    div_pos_neg_plot, script_pos_neg_plot = pos_neg_ratio_plot(project_id)
+    div_pos_neg_plot, script_pos_neg_plot = plots['pos_neg_plot']
     stats = []
-    for model in project.models:
-        num_pos = Instance.query.filter(db.and_(Instance.annotation.is_(1), Instance.model_id == model.id)).count()
-        num_neg = Instance.query.filter(db.and_(Instance.annotation.is_(0), Instance.model_id == model.id)).count()
-        num_skip = Instance.query.filter(db.and_(Instance.annotation.is_(-1), Instance.model_id == model.id)).count()
-        num_copied = Instance.query.filter(db.and_(Instance.copied.is_(1), Instance.model_id == model.id)).count()
-        stats.append((model.name, num_pos, num_neg, num_skip, num_copied))
+    rows = db.session.query(Model.name, ModelStats)\
+        .outerjoin(ModelStats, ModelStats.model_id == Model.id)\
+        .filter(Model.project_id == project_id)\
+        .order_by(Model.id)
+    for name, model_stats in rows:
+        if model_stats is None:
+            stats.append((name, 0, 0, 0, 0))
+        else:
+            stats.append((name, model_stats.num_pos, model_stats.num_neg,
+                          model_stats.num_skip, model_stats.num_copied))
 
     return render_template('insights.html', project=project,
                            div_scores_f1=div_scores_f1, script_scores_f1=script_scores_f1,
@@ -89,30 +97,58 @@ def project_insights(project_id):
 @app.route('/project/<int:project_id>/instances', methods=['GET', 'POST'])
 def project_instances(project_id):
     """
-    Project overview with project name, max_count and automatically updated
-    model connection status.
+    Instances page. Javascript loads the instances page by page while scrolling.
     :param project_id:
-    :return: render project overview
+    :return: render instances page
     """
     project = Project.query.get(project_id)
-    instances = Instance.query.filter_by(project_id=project_id).order_by(Instance.id.desc())
-    clazz = {0: 'table-danger', 1: 'table-success', None: 'table-dark', -1: ''}
-    rows = list()
-    for instance in instances:
-        rows.append(dict(id=instance.id,
-                         utterance=instance.utterance,
-                         annotation=instance.annotation,
-                         model=instance.model.name,
-                         clazz=clazz[instance.annotation],
-                         copied=int(instance.copied)))
+    return render_template('instances.html', project=project)
 
-    return render_template('instances.html', project=project, instances=rows)
+
+@app.route('/project/<int:project_id>/instances/page')
+def project_instances_page(project_id):
+    """
+    One page of instances, newest first. Keyset paginated on the instance id: pass the 'next' value
+    of the previous page as 'before' to get the following page. Optional filters 'model_id' and
+    'annotation' (1, 0, -1 or 'none') are served by the (model_id, annotation) and
+    (project_id, annotation) indexes. Called by javascript from frontend.
+    :param project_id:
+    :return: json: instances, next cursor or null on the last page
+    """
+    before = request.args.get('before', type=int)
+    limit = min(request.args.get('limit', 100, type=int), 500)
+    model_id = request.args.get('model_id', type=int)
+    annotation = request.args.get('annotation', '')
+    write_behind.flush()
+
+    query = db.session.query(Instance.id, Instance.utterance, Instance.annotation, Instance.copied, Model.name)\
+        .join(Model, Model.id == Instance.model_id)\
+        .filter(Instance.project_id == project_id)
+    if model_id is not None:
+        query = query.filter(Instance.model_id == model_id)
+    if annotation == 'none':
+        query = query.filter(Instance.annotation.is_(None))
+    elif annotation in ('1', '0', '-1'):
+        query = query.filter(Instance.annotation == int(annotation))
+    if before is not None:
+        query = query.filter(Instance.id < before)
+
+    rows = query.order_by(Instance.id.desc()).limit(limit + 1).all()
+    instances = [dict(id=instance_id,
+                      utterance=utterance,
+                      annotation=instance_annotation,
+                      copied=int(copied),
+                      model=model_name)
+                 for instance_id, utterance, instance_annotation, copied, model_name in rows[:limit]]
+    next_cursor = instances[-1]['id'] if len(rows) > limit else None
+
+    return jsonify(instances=instances, next=next_cursor)
 
 
 @app.route('/project/<int:project_id>/annotation', methods=['GET', 'POST'])
 def project_annotation(project_id):
     """
-    Annotation page. Javascript continuously queries for new utterances.
+    Annotation page. Javascript receives new utterances over the /annotator socket namespace.
     :param project_id:
     :return: render annotation page
     """
@@ -130,7 +166,9 @@ def create_project():
     form = EditProjectForm()
     if form.validate_on_submit():
         project = Project(name=form.data['name'],
-                          max_count=form.data['max_count'])
+                          max_count=form.data['max_count'],
+                          batch_size=form.data['batch_size'],
+                          reuse_annotations=form.data['reuse_annotations'])
         for model_data in form.data['models']:
             model = Model(name=model_data['name'])
             project.models.append(model)
@@ -155,6 +193,8 @@ def edit_project(project_id):
     if form.validate_on_submit():
         project.name = form.data['name']
         project.max_count = form.data['max_count']
+        project.batch_size = form.data['batch_size']
+        project.reuse_annotations = form.data['reuse_annotations']
 
         model_data_ids = set(m['id'] for m in form.data['models'])
         delete_models = [model.id for model in project.models if str(model.id) not in model_data_ids]
@@ -169,12 +209,19 @@ def edit_project(project_id):
                 model.name = model_data['name']
                 flash("Changed name of model '{}' to '{}'".format(model.name, model_data['name']), 'success')
 
+        if delete_models:
+            write_behind.flush()
         for model_id in delete_models:
             model = Model.query.get(model_id)
             flash("Deleted model '{}'".format(model.name), 'success')
             db.session.delete(model)
 
         db.session.commit()
+        if delete_models:
+            plot_cache.reset(project.id)
+        plot_cache.invalidate(project.id)
+        presence.reset(project.id)
+        sessions.invalidate_project(project.id)
         return redirect('/project/{}/overview'.format(project.id))
 
     models = [{'value': m.data['name'], 'errors': m.errors.get('name', []), 'id': m.data['id']} for m in form.models]
@@ -182,6 +229,32 @@ def edit_project(project_id):
     return render_template('edit_project.html', project=project, form=form, models=models, action=action)
 
 
+@app.route('/project/<int:project_id>/import', methods=['POST'])
+def import_simulation(project_id):
+    """
+    Bulk load the results file of a headless simulation (cmd.py -headless) into a model of the project.
+    Form fields: results: .npz file, model_name: optional, default the model name stored in the file.
+    :param project_id:
+    :return: json: model name, number of imported instances and scores
+    """
+    project = Project.query.get(project_id)
+    if project is None:
+        return "project not found", 404
+    upload = request.files.get('results')
+    if upload is None:
+        return "no results file", 400
+
+    try:
+        columns = results_import.load_results(upload.stream)
+        model, num_instances, num_scores = results_import.import_results(project, columns,
+                                                                         request.form.get('model_name'))
+    except ValueError as e:
+        return str(e), 400
+    print("imported {} instances and {} scores into model '{}'".format(num_instances, num_scores, model.name))
+
+    return jsonify({'model': model.name, 'instances': num_instances, 'scores': num_scores})
+
+
 @app.route('/annotate', methods=['POST'])
 def annotate():
     """
@@ -196,13 +269,10 @@ def annotate():
     if instance_id is None:
         return "no instance id found", 400
 
-    instance = Instance.query.get(instance_id)
-    instance.annotation = annotation
-    instance.submit_time = submit_time
-    db.session.commit()
+    if annotate_instance(instance_id, annotation, submit_time) is None:
+        return "instance not found", 404
     print(annotation)
 
-    send_annotation(instance)
     return jsonify({})
 
 
@@ -213,26 +283,12 @@ def next_instance(project_id):
     :param project_id:
     :return: json: instance_id, utterance
     """
-    instances = Instance.query.filter(db.and_(Instance.annotation.is_(None),
-                                              Instance.project_id == project_id)).all()
-    max_count_diff = 500
-    if len(instances) == 0:
+    instance = annotation_queue.next_instance(project_id)
+    if instance is None:
         message = "No instance without annotation left"
         print(message)
         return message, 500
 
-    models = Model.query.filter_by(project_id=project_id).order_by(Model.count).all()
-    # check the difference in annotated instances (count) between
-    # model with lowest count and highest count
-    if models[-1].count - models[0].count > max_count_diff:
-        instances = list(filter(lambda i: i.model.count - models[0].count < max_count_diff, instances))
-        if len(instances) == 0:
-            raise AttributeError('Count difference higher than {}'.format(max_count_diff))
-
-    instance = choice(instances)
-    instance.show_time = time.time()
-    db.session.commit()
-
     return jsonify({'instance_id': instance.id,
                     'utterance': instance.utterance})
 
@@ -240,17 +296,9 @@ def next_instance(project_id):
 @app.route('/project/<int:project_id>/status')
 def check_model_status(project_id):
     """
-    Query model status. Model is online if sid is saved in database.
-    Called from javascript in frontend
+    Query model status from the presence registry. Browsers subscribe to
+    the /status socket namespace to receive changes instead.
     :param project_id:
     :return: model name, connection status, current annotated instances
     """
-    project = Project.query.get(project_id)
-    response = list()
-    for model in project.models:
-        status = model.sid is not None
-        count = model.count
-        if count is not None:
-            count += 1
-        response.append({'name': model.name, 'status': status, 'count': count})
-    return jsonify(models=response)
+    return jsonify(models=presence.get_status(project_id))
@@ -0,0 +1,158 @@
+from . import app, db, socketio
+from .models import Instance, Model, Score, ModelStats
+
+from collections import Counter
+import threading
+
+# Instance and Score rows received from model clients are buffered here and written in
+# group commits, at most WRITE_BEHIND_WINDOW seconds or WRITE_BEHIND_MAX_BATCH rows later.
+# Everything that reads these tables calls flush() first.
+_instances = list()
+_scores = dict()
+_stats = dict()
+_counts = dict()
+_scheduled = False
+# number of failed flushes in a row, the buffered rows are dropped after WRITE_BEHIND_MAX_RETRIES
+_failures = 0
+_buffer_lock = threading.Lock()
+_flush_lock = threading.Lock()
+
+
+def add_instances(mappings, count):
+    """
+    Buffer new instances of one model and the count and ModelStats changes of the model.
+    All instances are written in the same transaction.
+    :param mappings: list of Instance column name -> value
+    :param count: count of the model sent with the instances
+    """
+    with _buffer_lock:
+        _instances.extend(mappings)
+        for mapping in mappings:
+            deltas = _stats.setdefault(mapping['model_id'], Counter())
+            deltas.update(num_instances=1, num_copied=int(mapping.get('copied', 0)))
+            deltas.update(ModelStats.annotation_deltas(mapping.get('annotation')))
+            _counts[mapping['model_id']] = count
+        size = len(_instances) + len(_scores)
+    _schedule(size)
+
+
+def add_score(mapping):
+    """
+    Buffer scores of a model. A later score with the same count replaces the earlier one.
+    :param mapping: Score column name -> value
+    """
+    with _buffer_lock:
+        _scores[(mapping['model_id'], mapping['count'])] = mapping
+        size = len(_instances) + len(_scores)
+    _schedule(size)
+
+
+def _schedule(size):
+    """
+    Flush right away if the window is disabled or the batch is full,
+    otherwise make sure a background flush is scheduled.
+    :param size: number of buffered rows
+    """
+    global _scheduled
+    window = app.config.get('WRITE_BEHIND_WINDOW', 0)
+    if window <= 0 or size >= app.config.get('WRITE_BEHIND_MAX_BATCH', 500):
+        flush()
+        return
+    with _buffer_lock:
+        if _scheduled:
+            return
+        _scheduled = True
+    socketio.start_background_task(_flush_later, window)
+
+
+def _flush_later(window):
+    """
+    Background task. Flush buffered rows after the window passed.
+    :param window: seconds to wait
+    """
+    global _scheduled
+    socketio.sleep(window)
+    with _buffer_lock:
+        _scheduled = False
+    with app.app_context():
+        if not flush():
+            # retry with the rows put back into the buffer
+            _schedule(0)
+
+
+def flush():
+    """
+    Write all buffered rows in a single transaction. Returns once rows buffered before
+    the call are committed, also if another flush is in progress. If the transaction fails
+    it is rolled back and the rows are put back into the buffer for the next flush.
+    :return: False if the rows could not be written
+    """
+    global _instances, _scores, _stats, _counts, _failures
+    with _flush_lock:
+        with _buffer_lock:
+            instances, scores, stats, counts = _instances, _scores, _stats, _counts
+            _instances, _scores, _stats, _counts = list(), dict(), dict(), dict()
+        if not (instances or scores):
+            return True
+
+        try:
+            _write(instances, scores, stats, counts)
+        except Exception as e:
+            db.session.rollback()
+            _failures += 1
+            if _failures >= app.config.get('WRITE_BEHIND_MAX_RETRIES', 3):
+                print('write behind: dropped {} instances and {} scores after {} failed flushes: {}'
+                      .format(len(instances), len(scores), _failures, e))
+                _failures = 0
+                return False
+            print('write behind: flush of {} instances and {} scores failed, retried with the next flush: {}'
+                  .format(len(instances), len(scores), e))
+            _requeue(instances, scores, stats, counts)
+            return False
+        _failures = 0
+        return True
+
+
+def _write(instances, scores, stats, counts):
+    """
+    Insert the rows and update counts and ModelStats in one transaction. Does not change its arguments.
+    """
+    stats = {model_id: Counter(deltas) for model_id, deltas in stats.items()}
+    if instances:
+        db.session.bulk_insert_mappings(Instance, instances)
+
+    if scores:
+        model_ids = set(model_id for model_id, _ in scores)
+        existing = set(db.session.query(Score.model_id, Score.count)
+                       .filter(Score.model_id.in_(model_ids),
+                               Score.count.in_(set(count for _, count in scores))))
+        db.session.bulk_insert_mappings(Score, [m for key, m in scores.items() if key not in existing])
+        for key in existing.intersection(scores):
+            db.session.merge(Score(**scores[key]))
+        for model_id, _ in set(scores).difference(existing):
+            stats.setdefault(model_id, Counter())['num_scores'] += 1
+        for model_id, _ in scores:
+            stats.setdefault(model_id, Counter())['score_version'] += 1
+
+    for model_id, count in counts.items():
+        Model.query.filter_by(id=model_id).update({'count': count})
+    for model_id, deltas in stats.items():
+        ModelStats.increment(model_id, **deltas)
+
+    db.session.commit()
+
+
+def _requeue(instances, scores, stats, counts):
+    """
+    Put rows of a failed flush back in front of the rows buffered in the meantime.
+    Newer scores and counts of the same model win.
+    """
+    global _instances
+    with _buffer_lock:
+        _instances = instances + _instances
+        for key, mapping in scores.items():
+            _scores.setdefault(key, mapping)
+        for model_id, deltas in stats.items():
+            _stats.setdefault(model_id, Counter()).update(deltas)
+        for model_id, count in counts.items():
+            _counts.setdefault(model_id, count)
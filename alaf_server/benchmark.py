@@ -0,0 +1,138 @@
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from sqlalchemy import create_engine, event, func, select
+
+from app import app, db
+from app.database import get_profile, engine_options, apply_pragmas
+from app.models import Project, Model, Instance
+
+# sqlite defaults, used as baseline
+sqlite_plain_pragmas = {'journal_mode': 'DELETE',
+                        'synchronous': 'FULL',
+                        'cache_size': -2000,
+                        'mmap_size': 0}
+
+
+# python benchmark.py -profiles sqlite_plain sqlite -n 2000
+# python benchmark.py -profiles postgresql -n 2000   # ALAF_POSTGRESQL_URI has to point to an empty scratch database!
+
+
+def get_engine(name, tmp_dir):
+    """
+    Engine for a profile. sqlite profiles use a fresh file in tmp_dir, 'sqlite_plain'
+    is sqlite with default settings as baseline.
+    :param name: profile name
+    :param tmp_dir: folder for sqlite files
+    :return: sqlalchemy engine
+    """
+    if name == 'sqlite_plain':
+        pragmas = sqlite_plain_pragmas
+    else:
+        profile = get_profile(dict(app.config, DATABASE_PROFILE=name))
+        if not profile['uri'].startswith('sqlite'):
+            return create_engine(profile['uri'], **engine_options(profile))
+        pragmas = profile.get('pragmas', {})
+
+    engine = create_engine('sqlite:///' + os.path.join(tmp_dir, name + '.db'),
+                           connect_args={'check_same_thread': False})
+    event.listen(engine, 'connect', lambda con, record: apply_pragmas(con, pragmas))
+    return engine
+
+
+def setup(engine):
+    """
+    Create tables and one project with one model.
+    :return: project_id, model_id
+    """
+    db.metadata.drop_all(engine)
+    db.metadata.create_all(engine)
+    with engine.begin() as con:
+        project_id = con.execute(Project.__table__.insert(), name='benchmark', max_count=0).inserted_primary_key[0]
+        model_id = con.execute(Model.__table__.insert(), name='benchmark', project_id=project_id,
+                               count=0).inserted_primary_key[0]
+    return project_id, model_id
+
+
+def instance_row(project_id, model_id, i):
+    return dict(project_id=project_id, model_id=model_id, utterance='utterance {}'.format(i),
+                annotation=i % 2, client_time=0.1, al_time=0.1, io_time=0.01, copied=False)
+
+
+def write_single(engine, project_id, model_id, n):
+    """
+    One commit per instance, like one commit per socket event.
+    :return: rows per second
+    """
+    start = time.time()
+    for i in range(n):
+        with engine.begin() as con:
+            con.execute(Instance.__table__.insert(), instance_row(project_id, model_id, i))
+    return n / (time.time() - start)
+
+
+def write_batched(engine, project_id, model_id, n, batch_size=100):
+    """
+    Group commits of batch_size instances.
+    :return: rows per second
+    """
+    start = time.time()
+    for i in range(0, n, batch_size):
+        with engine.begin() as con:
+            con.execute(Instance.__table__.insert(),
+                        [instance_row(project_id, model_id, j) for j in range(i, min(i + batch_size, n))])
+    return n / (time.time() - start)
+
+
+def read_while_writing(engine, project_id, model_id, n):
+    """
+    Insights like aggregate reads while a writer commits single instances.
+    :return: reads per second
+    """
+    done = threading.Event()
+
+    def writer():
+        i = 0
+        while not done.is_set():
+            with engine.begin() as con:
+                con.execute(Instance.__table__.insert(), instance_row(project_id, model_id, i))
+            i += 1
+
+    thread = threading.Thread(target=writer, daemon=True)
+    thread.start()
+    query = select([Instance.annotation, func.count(Instance.id)])\
+        .where(Instance.model_id == model_id)\
+        .group_by(Instance.annotation)
+    start = time.time()
+    for _ in range(n):
+        with engine.connect() as con:
+            con.execute(query).fetchall()
+    reads_per_second = n / (time.time() - start)
+    done.set()
+    thread.join()
+    return reads_per_second
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write and read throughput of database profiles')
+
+    parser.add_argument('-profiles', type=str, nargs='+', default=['sqlite_plain', 'sqlite'],
+                        help='Profiles from config.py or sqlite_plain for sqlite with default settings')
+
+    parser.add_argument('-n', type=int, default=2000,
+                        help='Number of rows/queries per measurement')
+
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in args.profiles:
+            engine = get_engine(name, tmp_dir)
+            project_id, model_id = setup(engine)
+            single = write_single(engine, project_id, model_id, args.n)
+            batched = write_batched(engine, project_id, model_id, args.n)
+            reads = read_while_writing(engine, project_id, model_id, max(args.n // 10, 1))
+            print('{:<14} single commit: {:>9.0f} rows/s   group commit: {:>9.0f} rows/s   '
+                  'reads while writing: {:>7.0f} queries/s'.format(name, single, batched, reads))
+            engine.dispose()
@@ -1,4 +1,22 @@
 from app import db
+from app.database import upgrade_schema
+from app.models import Model, ModelStats, Instance
 
-# create database tables
-db.create_all()
+# create database tables, add columns and indexes missing in databases of older versions
+upgrade_schema(db.engine, db.metadata)
+
+# fill aggregated counters for models created before the stats table existed
+for model in Model.query.filter(Model.stats == None).all():
+    ModelStats.rebuild(model.id)
+db.session.commit()
+
+# fill utterance hashes of instances created before the column existed
+while True:
+    rows = Instance.query.with_entities(Instance.id, Instance.utterance)\
+        .filter(Instance.utterance_hash == None).limit(10000).all()
+    if not rows:
+        break
+    db.session.bulk_update_mappings(Instance, [{'id': instance_id,
+                                                'utterance_hash': Instance.hash_utterance(utterance or '')}
+                                               for instance_id, utterance in rows])
+    db.session.commit()
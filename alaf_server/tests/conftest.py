@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the server is not installed, tests import app and config from alaf_server
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
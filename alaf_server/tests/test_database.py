@@ -0,0 +1,167 @@
+import copy
+import os
+import uuid
+from types import SimpleNamespace
+
+import pytest
+import sqlalchemy as sa
+
+import config
+from app import app, database, db
+
+postgresql_uri = os.environ.get('ALAF_POSTGRESQL_URI')
+
+
+def create_baseline_schema(engine):
+    """
+    Tables as created by the first version of the server, before upgrade_schema existed.
+    :param engine: sqlalchemy engine
+    """
+    metadata = sa.MetaData()
+    sa.Table('project', metadata,
+             sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+             sa.Column('name', sa.String(75), unique=True),
+             sa.Column('max_count', sa.Integer))
+    sa.Table('model', metadata,
+             sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+             sa.Column('name', sa.String(75)),
+             sa.Column('project_id', sa.Integer, sa.ForeignKey('project.id')),
+             sa.Column('sid', sa.String(100)),
+             sa.Column('count', sa.Integer),
+             sa.Index('model_name_project_id_uindex', 'name', 'project_id'))
+    sa.Table('instance', metadata,
+             sa.Column('id', sa.Integer, primary_key=True, autoincrement=True),
+             sa.Column('project_id', sa.Integer, sa.ForeignKey('project.id')),
+             sa.Column('model_id', sa.Integer, sa.ForeignKey('model.id')),
+             sa.Column('utterance', sa.Text, index=True),
+             sa.Column('annotation', sa.Integer, nullable=True),
+             sa.Column('client_time', sa.Float, nullable=True),
+             sa.Column('al_time', sa.Float, nullable=True),
+             sa.Column('io_time', sa.Float, nullable=True),
+             sa.Column('show_time', sa.Float, nullable=True),
+             sa.Column('submit_time', sa.Float, nullable=True),
+             sa.Column('copied', sa.Boolean, default=0))
+    sa.Table('score', metadata,
+             sa.Column('count', sa.Integer, primary_key=True),
+             sa.Column('model_id', sa.Integer, sa.ForeignKey('model.id'), primary_key=True),
+             sa.Column('f1', sa.Float),
+             sa.Column('precision', sa.Float),
+             sa.Column('recall', sa.Float))
+    metadata.create_all(engine)
+
+    engine.execute("INSERT INTO project (id, name, max_count) VALUES (1, 'old', 100)")
+    engine.execute("INSERT INTO model (id, name, project_id, count) VALUES (1, 'lc', 1, 1)")
+    engine.execute("INSERT INTO instance (id, project_id, model_id, utterance, annotation, copied) "
+                   "VALUES (1, 1, 1, 'an old utterance', 1, false)")
+
+
+def assert_upgraded(engine):
+    """
+    The baseline schema has the columns and indexes of the current models after upgrade_schema.
+    :param engine: sqlalchemy engine
+    """
+    inspector = sa.inspect(engine)
+    for table in db.metadata.sorted_tables:
+        columns = set(c['name'] for c in inspector.get_columns(table.name))
+        assert set(column.name for column in table.columns) <= columns, table.name
+        indexes = set(i['name'] for i in inspector.get_indexes(table.name))
+        assert set(index.name for index in table.indexes) <= indexes, table.name
+
+    project_columns = set(c['name'] for c in inspector.get_columns('project'))
+    assert {'batch_size', 'reuse_annotations'} <= project_columns
+    assert 'utterance_hash' in set(c['name'] for c in inspector.get_columns('instance'))
+    assert 'model_stats' in inspector.get_table_names()
+
+    instance_indexes = set(i['name'] for i in inspector.get_indexes('instance'))
+    assert {'instance_project_id_annotation_index',
+            'instance_model_id_annotation_index',
+            'instance_project_id_utterance_hash_index'} <= instance_indexes
+    assert 'ix_instance_utterance' not in instance_indexes
+
+    # rows of the old version are kept
+    assert engine.execute('SELECT utterance, annotation FROM instance').fetchall() == [('an old utterance', 1)]
+    assert engine.execute('SELECT name, max_count FROM project').fetchall() == [('old', 100)]
+
+
+@pytest.fixture
+def sqlite_engine(tmp_path):
+    engine = sa.create_engine('sqlite:///' + str(tmp_path / 'baseline.db'))
+    yield engine
+    engine.dispose()
+
+
+@pytest.fixture
+def restore_profile():
+    yield
+    database.configure(app)
+
+
+def test_upgrade_baseline_sqlite(sqlite_engine):
+    create_baseline_schema(sqlite_engine)
+    database.upgrade_schema(sqlite_engine, db.metadata)
+    assert_upgraded(sqlite_engine)
+
+
+def test_upgrade_twice_changes_nothing(sqlite_engine, capsys):
+    create_baseline_schema(sqlite_engine)
+    database.upgrade_schema(sqlite_engine, db.metadata)
+    capsys.readouterr()
+    database.upgrade_schema(sqlite_engine, db.metadata)
+    assert capsys.readouterr().out == ''
+    assert_upgraded(sqlite_engine)
+
+
+def test_unknown_profile():
+    with pytest.raises(ValueError):
+        database.get_profile({'DATABASE_PROFILE': 'mysql', 'DATABASE_PROFILES': config.DATABASE_PROFILES})
+
+
+def test_configure_postgresql_profile(restore_profile):
+    fake = SimpleNamespace(config={'DATABASE_PROFILE': 'postgresql',
+                                   'DATABASE_PROFILES': config.DATABASE_PROFILES})
+    database.configure(fake)
+    profile = config.DATABASE_PROFILES['postgresql']
+    assert fake.config['SQLALCHEMY_DATABASE_URI'] == profile['uri']
+    assert fake.config['SQLALCHEMY_POOL_SIZE'] == profile['pool_size']
+    assert fake.config['SQLALCHEMY_MAX_OVERFLOW'] == profile['max_overflow']
+    assert fake.config['SQLALCHEMY_POOL_RECYCLE'] == profile['pool_recycle']
+    assert database._sqlite_pragmas == {}
+
+
+def test_configure_sqlite_pragmas(tmp_path, restore_profile):
+    profiles = copy.deepcopy(config.DATABASE_PROFILES)
+    profiles['sqlite']['uri'] = 'sqlite:///' + str(tmp_path / 'pragmas.db')
+    fake = SimpleNamespace(config={'DATABASE_PROFILE': 'sqlite', 'DATABASE_PROFILES': profiles})
+    database.configure(fake)
+    assert 'SQLALCHEMY_POOL_SIZE' not in fake.config
+
+    engine = sa.create_engine(fake.config['SQLALCHEMY_DATABASE_URI'])
+    assert engine.execute('PRAGMA journal_mode').scalar() == 'wal'
+    assert engine.execute('PRAGMA synchronous').scalar() == 1  # NORMAL
+    assert engine.execute('PRAGMA busy_timeout').scalar() == 5000
+    engine.dispose()
+
+
+@pytest.mark.skipif(postgresql_uri is None, reason='set ALAF_POSTGRESQL_URI to test the postgresql profile')
+def test_upgrade_baseline_postgresql(restore_profile):
+    pytest.importorskip('psycopg2')
+    fake = SimpleNamespace(config={'DATABASE_PROFILE': 'postgresql',
+                                   'DATABASE_PROFILES': config.DATABASE_PROFILES})
+    database.configure(fake)
+    profile = database.get_profile(fake.config)
+
+    # work in a schema of its own, tables of the server in the database are not touched
+    schema = 'alaf_test_{}'.format(uuid.uuid4().hex[:8])
+    admin = sa.create_engine(profile['uri'])
+    admin.execute('CREATE SCHEMA {}'.format(schema))
+    engine = sa.create_engine(profile['uri'], connect_args={'options': '-csearch_path={}'.format(schema)},
+                              **database.engine_options(profile))
+    try:
+        create_baseline_schema(engine)
+        database.upgrade_schema(engine, db.metadata)
+        assert_upgraded(engine)
+        assert engine.pool.size() == profile['pool_size']
+    finally:
+        engine.dispose()
+        admin.execute('DROP SCHEMA {} CASCADE'.format(schema))
+        admin.dispose()